@@ -1,24 +1,336 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
-from clickhouse_connect import get_client
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, date
+import asyncio
+import contextvars
+import csv
+import hashlib
+import io
+import itertools
+import json
 import os
 import logging
+import math
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd request bodies are rejected without it
+    zstandard = None
 
 logging.basicConfig(level=logging.INFO)
-app = FastAPI(title="Vehicle Data API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing touches the network at import; the schema check is the only startup I/O
+    start = time.perf_counter()
+    if SCHEMA_CHECK != "off":
+        await asyncio.to_thread(verify_table_schemas)
+    logging.info("Startup finished in %.3fs", time.perf_counter() - start)
+    expiry_scan = asyncio.create_task(expiry_scan_loop()) if EXPIRY_SCAN_INTERVAL > 0 else None
+    # Filters build in the background; until ready, /exists confirms every key in ClickHouse
+    membership_refresh = asyncio.create_task(membership_refresh_loop()) if BLOOM_FILTERS else None
+    yield
+    for task in (expiry_scan, membership_refresh):
+        if task:
+            task.cancel()
+    client.close()
+
+app = FastAPI(title="Vehicle Data API", version="1.0.0", lifespan=lifespan)
 
 # ----------------------------
 # ClickHouse Client
 # ----------------------------
-client = get_client(
-    host=os.getenv("CH_HOST", "localhost"),
-    username=os.getenv("CH_USER", "admin"),
-    password=os.getenv("CH_PASS", "rishu123"),
-    port=int(os.getenv("CH_PORT", "8123")),
-    database=os.getenv("CH_DB", "vehicle_fastag")
-)
+class LazyResource:
+    """Create the wrapped object on first attribute access instead of at import."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def close(self):
+        if self._instance is not None:
+            self._instance.close()
+            self._instance = None
+
+def connect_clickhouse():
+    from clickhouse_connect import get_client
+    return get_client(
+        host=os.getenv("CH_HOST", "localhost"),
+        username=os.getenv("CH_USER", "admin"),
+        password=os.getenv("CH_PASS", "rishu123"),
+        port=int(os.getenv("CH_PORT", "8123")),
+        database=os.getenv("CH_DB", "vehicle_fastag"),
+        # lz4/zstd/gzip compress inserts and query results on the wire; "none" disables
+        compress=False if os.getenv("CH_COMPRESS", "lz4") == "none" else os.getenv("CH_COMPRESS", "lz4"),
+        # No shared session so read endpoints can run queries concurrently
+        autogenerate_session_id=False
+    )
+
+client = LazyResource(connect_clickhouse)
+
+VEHICLE360_TIMEOUT = float(os.getenv("VEHICLE360_TIMEOUT", "2.0"))
+VEHICLE360_CACHE_TTL = float(os.getenv("VEHICLE360_CACHE_TTL", "30"))
+VEHICLE360_CACHE_MAX = int(os.getenv("VEHICLE360_CACHE_MAX", "10000"))
+VEHICLE360_WORKERS = int(os.getenv("VEHICLE360_WORKERS", "32"))
+
+# "incremental" inserts only new/changed service records, "full" re-inserts the whole list
+SERVICE_HISTORY_MODE = os.getenv("SERVICE_HISTORY_MODE", "incremental")
+SERVICE_WATERMARK_CACHE_MAX = int(os.getenv("SERVICE_WATERMARK_CACHE_MAX", "100000"))
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "100000"))
+EXPORT_PAGE_SIZE_MAX = int(os.getenv("EXPORT_PAGE_SIZE_MAX", "1000000"))
+
+API_COMPRESS_MIN_SIZE = int(os.getenv("API_COMPRESS_MIN_SIZE", "1024"))
+API_COMPRESS_LEVEL = int(os.getenv("API_COMPRESS_LEVEL", "6"))
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(32 * 1024 * 1024)))
+
+# ----------------------------
+# Middleware
+# ----------------------------
+class RequestDecompressionMiddleware:
+    """Decompress gzip/zstd request bodies before they reach the handlers."""
+
+    def __init__(self, app, max_size=MAX_DECOMPRESSED_BODY):
+        self.app = app
+        self.max_size = max_size
+
+    def decompress(self, encoding, body):
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(body, self.max_size + 1)
+        else:
+            with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+                data = reader.read(self.max_size + 1)
+        # Bounded output so a small compressed body cannot expand without limit
+        if len(data) > self.max_size:
+            raise OverflowError
+        return data
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = [(k, v) for k, v in scope["headers"] if k != b"content-length"]
+        encoding = dict(headers).get(b"content-encoding", b"").decode().strip().lower()
+        if encoding not in ("gzip", "zstd"):
+            return await self.app(scope, receive, send)
+        if encoding == "zstd" and zstandard is None:
+            return await JSONResponse({"detail": "zstd request bodies are not supported"}, status_code=415)(scope, receive, send)
+
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        try:
+            body = self.decompress(encoding, b"".join(chunks))
+        except OverflowError:
+            return await JSONResponse({"detail": "Decompressed body too large"}, status_code=413)(scope, receive, send)
+        except Exception:
+            return await JSONResponse({"detail": f"Invalid {encoding} request body"}, status_code=400)(scope, receive, send)
+
+        headers = [(k, v) for k, v in headers if k != b"content-encoding"]
+        headers.append((b"content-length", str(len(body)).encode()))
+        sent = False
+
+        async def receive_decompressed():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(dict(scope, headers=headers), receive_decompressed, send)
+
+# Opt-in: log a stage breakdown for TRACE_SAMPLE_RATE of requests and for any slower than SLOW_REQUEST_MS
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+class RequestTrace:
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={duration * 1000:.2f}" for name, duration in self.stages)
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def mark_stage(name):
+    """Attribute the time since the previous mark (or request start) to stage name."""
+    trace = current_trace.get()
+    if trace is None:
+        return
+    now = time.perf_counter()
+    trace.stages.append((name, now - trace.last))
+    trace.last = now
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (TRACE_SAMPLE_RATE <= 0 and SLOW_REQUEST_MS <= 0):
+            return await self.app(scope, receive, send)
+        trace = RequestTrace()
+        sampled = random.random() < TRACE_SAMPLE_RATE
+        status, payload_bytes = 500, 0
+
+        async def receive_counted():
+            nonlocal payload_bytes
+            message = await receive()
+            payload_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if sampled and trace.stages:
+                    headers = list(message.get("headers", [])) + [(b"server-timing", trace.server_timing().encode())]
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive_counted, send_traced)
+        finally:
+            current_trace.reset(token)
+            total_ms = (time.perf_counter() - trace.start) * 1000
+            slow = SLOW_REQUEST_MS > 0 and total_ms >= SLOW_REQUEST_MS
+            if sampled or slow:
+                logging.log(logging.WARNING if slow else logging.INFO, "%s %s", "slow_request" if slow else "trace", json.dumps({
+                    "method": scope["method"], "path": scope["path"], "status": status,
+                    "total_ms": round(total_ms, 2), "payload_bytes": payload_bytes,
+                    "stages_ms": {name: round(duration * 1000, 2) for name, duration in trace.stages},
+                }))
+
+app.add_middleware(GZipMiddleware, minimum_size=API_COMPRESS_MIN_SIZE, compresslevel=API_COMPRESS_LEVEL)
+app.add_middleware(RequestDecompressionMiddleware)
+app.add_middleware(TracingMiddleware)
+
+# ----------------------------
+# Blob Store
+# ----------------------------
+# Inline values above BLOB_INLINE_MAX bytes are moved out of the row and
+# replaced by "blob:sha256:<digest>"; URLs are left inline. Offloading is off
+# unless BLOB_STORE_URL names a store every worker can read (s3:// or a shared path).
+BLOB_STORE_URL = os.getenv("BLOB_STORE_URL")
+BLOB_INLINE_MAX = int(os.getenv("BLOB_INLINE_MAX", "2048"))
+BLOB_CACHE_MAX = int(os.getenv("BLOB_CACHE_MAX", "100000"))
+BLOB_REF_PREFIX = "blob:sha256:"
+
+class FilesystemBlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, digest, data):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, digest):
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+class S3BlobStore:
+    def __init__(self, bucket, prefix):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("BLOB_STORE_URL=s3://... requires boto3")
+        self.s3 = boto3.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def key(self, digest):
+        return f"{self.prefix}/{digest}" if self.prefix else digest
+
+    def exists(self, digest):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.key(digest))
+            return True
+        except self.s3.exceptions.ClientError:
+            return False
+
+    def put(self, digest, data):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key(digest), Body=data)
+
+    def get(self, digest):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self.key(digest))["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+def open_blob_store(url):
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3BlobStore(bucket, prefix)
+    return FilesystemBlobStore(url[len("file://"):] if url.startswith("file://") else url)
+
+blob_store = LazyResource(lambda: open_blob_store(BLOB_STORE_URL)) if BLOB_STORE_URL else None
+# Digests known to be stored (LRU), so repeated images skip the existence check.
+# Offloading runs in worker threads, hence the lock.
+stored_blobs = OrderedDict()
+stored_blobs_lock = threading.Lock()
+
+def offload_blob(value):
+    """Return value, or a blob reference if it is a large inline payload."""
+    if blob_store is None or not value or value.startswith(("http://", "https://", BLOB_REF_PREFIX)):
+        return value
+    data = value.encode()
+    if len(data) <= BLOB_INLINE_MAX:
+        return value
+    digest = hashlib.sha256(data).hexdigest()
+    with stored_blobs_lock:
+        known = stored_blobs.pop(digest, None) is not None
+        if known:
+            stored_blobs[digest] = True
+    if not known:
+        if not blob_store.exists(digest):
+            blob_store.put(digest, data)
+        with stored_blobs_lock:
+            stored_blobs[digest] = True
+            if len(stored_blobs) > BLOB_CACHE_MAX:
+                stored_blobs.popitem(last=False)
+    return BLOB_REF_PREFIX + digest
 
 # ----------------------------
 # Helper Functions
@@ -70,6 +382,72 @@ def bool_to_uint8(value):
         return 1
     return 0
 
+def normalize_lookup_key(value):
+    return (value or "").strip().upper()
+
+def canonical_vehicle_key(value):
+    """Registration number with case, spaces, dashes and other separators removed."""
+    return re.sub(r"[^0-9A-Z]", "", str(value if value is not None else "").upper())
+
+IDENTITY_CACHE_MAX = int(os.getenv("IDENTITY_CACHE_MAX", "500000"))
+# (canonical_key, source, source_key) already written by this worker
+known_identities = set()
+
+def record_identity(source, keys):
+    """Map each raw vehicle key from source to its canonical key in vehicle_identity."""
+    now = datetime.now()
+    rows, new = [], set()
+    for key in keys:
+        # Keep the raw value: it is what the source table stores and is queried by
+        key = str(key) if key is not None else ""
+        canonical = canonical_vehicle_key(key)
+        identity = (canonical, source, key)
+        if not canonical or identity in known_identities or identity in new:
+            continue
+        new.add(identity)
+        rows.append(table_row("vehicle_identity", {"canonical_key": canonical, "source": source, "source_key": key, "updated_on": now}))
+    if not rows:
+        return
+    create_vehicle_identity_table_if_not_exists()
+    insert_rows("vehicle_identity", rows)
+    if len(known_identities) + len(new) > IDENTITY_CACHE_MAX:
+        known_identities.clear()
+    known_identities.update(new)
+
+def resolve_identity(value):
+    """Raw keys per source table for the vehicle value refers to."""
+    create_vehicle_identity_table_if_not_exists()
+    result = client.query(
+        "SELECT DISTINCT source, source_key FROM vehicle_identity WHERE canonical_key = {key:String}",
+        parameters={"key": canonical_vehicle_key(value)},
+    )
+    identity = {}
+    for source, source_key in result.result_rows:
+        identity.setdefault(source, []).append(source_key)
+    return identity
+
+def index_chassis_keys(entries, source):
+    """Write (key, key_type, rc_number) entries to the chassis exact and suffix indexes."""
+    now = datetime.now()
+    rows, seen = [], set()
+    for key, key_type, rc_number in entries:
+        key = normalize_lookup_key(key)
+        if key and rc_number and (key, key_type, rc_number) not in seen:
+            seen.add((key, key_type, rc_number))
+            rows.append(table_row("vehicle_chassis_index", {
+                "lookup_key": key, "lookup_key_rev": key[::-1], "key_type": key_type,
+                "rc_number": rc_number, "source": source, "updated_on": now,
+            }))
+    if not rows:
+        return
+    create_vehicle_chassis_index_table_if_not_exists()
+    # Both tables get the same rows, so both inserts name the columns in vehicle_chassis_index order
+    for table in ("vehicle_chassis_index", "vehicle_chassis_suffix_index"):
+        client.insert(table, rows, column_names=table_columns("vehicle_chassis_index"))
+
+def query_dicts(sql, parameters=None, settings=None):
+    return list(client.query(sql, parameters=parameters, settings=settings).named_results())
+
 # ----------------------------
 # Models
 # ----------------------------
@@ -114,7 +492,7 @@ class VehicleRCData(BaseModel):
     tax_upto: Optional[str] = None
     tax_paid_upto: Optional[str] = None
     cubic_capacity: Optional[str] = None
-    vehicle_gross_weight: Optional[int] = None
+    vehicle_gross_weight: Optional[float] = None
     no_cylinders: Optional[str] = None
     seat_capacity: Optional[str] = None
     sleeper_capacity: Optional[str] = None
@@ -319,304 +697,669 @@ class VehicleServiceHistory(BaseModel):
     vehicleNumber: str
     serviceHistoryDetails: List[Mahindraservice]
 
+class ExistsRequest(BaseModel):
+    keys: List[str]
+    sets: Optional[List[str]] = None
+
 
 
 
 
 # ----------------------------
-# Table Creation
+# Table Specs
 # ----------------------------
+# Single source of truth for DDL, insert column order and the startup schema check.
+# A column is (name, type), (name, type, default) or (name, [(sub, type), ...]) for Nested.
+TABLE_SPECS = {
+    "fastag_details": {
+        "columns": [
+            ("TagId", "String"),
+            ("VRN", "String"),
+            ("Tag_Status", "String"),
+            ("Vehicle_Class", "String"),
+            ("Action", "String"),
+            ("Issue_Date", "Nullable(Date)"),
+            ("Issuer_Bank", "String"),
+            ("Last_Update", "Nullable(DateTime)"),
+            ("created_on", "DateTime"),
+            ("updated_on", "DateTime"),
+            ("is_current", "UInt8"),
+            ("is_changed", "UInt8"),
+            ("dwid", "Nullable(String)"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "TagId",
+    },
+    "vehicle_rc_v10": {
+        "columns": [
+            ("rc_number", "String"),
+            ("registration_date", "Nullable(Date)"),
+            ("owner_name", "String"),
+            ("father_name", "String"),
+            ("present_address", "String"),
+            ("permanent_address", "String"),
+            ("mobile_number", "String"),
+            ("vehicle_category", "String"),
+            ("vehicle_chasi_number", "String"),
+            ("vehicle_engine_number", "String"),
+            ("maker_description", "String"),
+            ("maker_model", "String"),
+            ("body_type", "String"),
+            ("fuel_type", "String"),
+            ("color", "String"),
+            ("norms_type", "String"),
+            ("fit_up_to", "Nullable(Date)"),
+            ("financer", "String"),
+            ("financed", "String"),
+            ("insurance_company", "String"),
+            ("insurance_policy_number", "String"),
+            ("insurance_upto", "Nullable(Date)"),
+            ("manufacturing_date", "String"),
+            ("manufacturing_date_formatted", "String"),
+            ("registered_at", "String"),
+            ("latest_by", "Nullable(DateTime)"),
+            ("less_info", "UInt8"),
+            ("tax_upto", "Nullable(Date)"),
+            ("tax_paid_upto", "Nullable(Date)"),
+            ("cubic_capacity", "Nullable(Float32)"),
+            ("vehicle_gross_weight", "Nullable(Float32)"),
+            ("no_cylinders", "Nullable(UInt8)"),
+            ("seat_capacity", "Nullable(UInt8)"),
+            ("sleeper_capacity", "String"),
+            ("standing_capacity", "String"),
+            ("wheelbase", "String"),
+            ("unladen_weight", "String"),
+            ("vehicle_category_description", "String"),
+            ("pucc_number", "String"),
+            ("pucc_upto", "Nullable(Date)"),
+            ("permit_number", "String"),
+            ("permit_issue_date", "String"),
+            ("permit_valid_from", "String"),
+            ("permit_valid_upto", "String"),
+            ("permit_type", "String"),
+            ("national_permit_number", "String"),
+            ("national_permit_upto", "Nullable(Date)"),
+            ("national_permit_issued_by", "String"),
+            ("non_use_status", "Nullable(UInt8)"),
+            ("non_use_from", "Nullable(Date)"),
+            ("non_use_to", "Nullable(Date)"),
+            ("blacklist_status", "String"),
+            ("noc_details", "String"),
+            ("owner_number", "String"),
+            ("rc_status", "String"),
+            ("masked_name", "UInt8"),
+            ("variant", "Nullable(String)"),
+            ("permanent_Pincode", "String"),
+            ("is_luxuryMover", "String"),
+            ("make_Name", "String"),
+            ("model_Name", "String"),
+            ("variant_Name", "String"),
+            ("statusAsOn", "String"),
+            ("isCommercial", "String"),
+            ("manufacture_Year", "String"),
+            ("purchase_Date", "String"),
+            ("rto_Code", "String"),
+            ("rto_Name", "String"),
+            ("regAuthority", "String"),
+            ("rcStandardCap", "String"),
+            ("blacklistDetails", "String"),
+            ("dbResult", "String"),
+            ("result", "String"),
+            ("recommended_Vehicle", "String"),
+            ("carVariant", "String"),
+            ("cityofRegitration", "String"),
+            ("cityofRegitrationId", "String"),
+            ("manufactureMonth", "String"),
+            ("expiryDuration", "String"),
+            ("city", "String"),
+            ("year", "String"),
+            ("status", "String"),
+            ("created_on", "DateTime"),
+            ("updated_on", "DateTime"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "rc_number",
+    },
+    "vehicle_challan": {
+        "columns": [
+            ("forChallan", "Nullable(String)"),
+            ("typeAccused", "Nullable(String)"),
+            ("nameViolator", "Nullable(String)"),
+            ("violatorFatherName", "Nullable(String)"),
+            ("violatorContactNo", "Nullable(String)"),
+            ("dlRcNumber", "String"),
+            ("challanNo", "String"),
+            ("State", "String"),
+            ("dateChallan", "Nullable(DateTime)"),
+            ("detailsViolation", [("offence", "String"), ("penalty", "Nullable(String)")]),
+            ("investigateUnder", "Nullable(String)"),
+            ("longLat", "Nullable(String)"),
+            ("locationChallan", "Nullable(String)"),
+            ("remarkChallan", "Nullable(String)"),
+            ("typeBook", "Nullable(String)"),
+            ("bookNo", "Nullable(String)"),
+            ("formNo", "Nullable(String)"),
+            ("witness1", "Nullable(String)"),
+            ("witness2", "Nullable(String)"),
+            ("witness3", "Nullable(String)"),
+            ("imagesChallan", "Nullable(String)"),
+            ("imageVehicle", "Nullable(String)"),
+            ("imageCCTV1", "Nullable(String)"),
+            ("imageCCTV2", "Nullable(String)"),
+            ("numberDL", "Nullable(String)"),
+            ("detailsDL", "Nullable(String)"),
+            ("suspendISDL", "Nullable(String)"),
+            ("accNameDL", "Nullable(String)"),
+            ("accAddressDL", "Nullable(String)"),
+            ("accFatherNameDL", "Nullable(String)"),
+            ("accAgeDL", "Nullable(String)"),
+            ("accGenderDL", "Nullable(String)"),
+            ("validityDL", "Nullable(String)"),
+            ("issueDateDL", "Nullable(String)"),
+            ("issuedByDL", "Nullable(String)"),
+            ("amountChallan", "UInt32"),
+            ("status", "String"),
+            ("sourcePayment", "Nullable(String)"),
+            ("datePayment", "Nullable(String)"),
+            ("IDTransaction", "Nullable(String)"),
+            ("noReceipt", "Nullable(String)"),
+            ("noReceiptOffline", "Nullable(String)"),
+            ("receiptOffline", "Nullable(String)"),
+            ("noMobile", "Nullable(String)"),
+            ("byPayment", "Nullable(String)"),
+            ("acfIS", "Nullable(String)"),
+            ("amountACF", "Nullable(UInt32)"),
+            ("noReceiptACF", "Nullable(String)"),
+            ("nameRTO", "Nullable(String)"),
+            ("impoundDocument", "Nullable(String)"),
+            ("impoundVehicle", "Nullable(String)"),
+            ("classVehicle", "Nullable(String)"),
+            ("typeVehicle", "Nullable(String)"),
+            ("uptoVehicle", "Nullable(String)"),
+            ("uptoPermit", "Nullable(String)"),
+            ("rcNo", "String"),
+            ("noChassis", "Nullable(String)"),
+            ("noEngine", "Nullable(String)"),
+            ("noVehOwner", "Nullable(String)"),
+            ("nameOwner", "Nullable(String)"),
+            ("nameFatherOwner", "Nullable(String)"),
+            ("addressOwner", "Nullable(String)"),
+            ("idCourt", "Nullable(String)"),
+            ("statusCourt", "Nullable(String)"),
+            ("idCourtRelated", "Nullable(String)"),
+            ("imgOrderRelease", "Nullable(String)"),
+            ("dateRelease", "Nullable(String)"),
+            ("noReceiptCourt", "Nullable(String)"),
+            ("byAction", "Nullable(String)"),
+            ("noDispatch", "Nullable(String)"),
+            ("nameCourt", "Nullable(String)"),
+            ("chargesUser", "Nullable(String)"),
+            ("challan_search_source", "Nullable(String)"),
+            ("court_status_desc", "Nullable(String)"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "challanNo",
+    },
+    # One row per ViolationDetails, ordered for offence-centric lookups; filled by
+    # vehicle_challan_violation_mv, never written directly
+    "vehicle_challan_violation": {
+        "columns": [
+            ("offence", "String"),
+            ("challanNo", "String"),
+            ("penalty", "Nullable(String)"),
+            ("dlRcNumber", "String"),
+            ("rcNo", "String"),
+            ("State", "String"),
+            ("dateChallan", "DateTime"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "(offence, challanNo)",
+    },
+    "vehicle_rc_black_list": {
+        "columns": [
+            ("regNo", "String"),
+            ("stateCode", "String"),
+            ("regDate", "Date"),
+            ("vehicleClass", "String"),
+            ("classCode", "String"),
+            ("model", "String"),
+            ("fuelType", "String"),
+            ("owner", "String"),
+            ("rcExpiryDate", "Date"),
+            ("vehicleTaxUpto", "String"),
+            ("emissionNorms", "String"),
+            ("normsCode", "String"),
+            ("insurance_companyName", "String"),
+            ("insurance_validUpto", "Date"),
+            ("financier_name", "String"),
+            ("financedFrom", "String"),
+            ("registrationAuthority", "String"),
+            ("puccUpto", "String"),
+            ("blacklistStatus", "String"),
+            ("nocDetails", "String"),
+            ("status", "String"),
+            ("statusAsOn", "Date"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "(regNo)",
+    },
+    "vehicle_challan_all_state": {
+        "columns": [
+            ("number", "Int32"),
+            ("challanNumber", "String"),
+            ("offenseDetails", "String"),
+            ("challanPlace", "String"),
+            ("payment_url", "Nullable(String)"),
+            ("image_url", "Nullable(String)"),
+            ("challanDate", "Date"),
+            ("state", "String"),
+            ("rto", "String"),
+            ("accusedName", "String"),
+            ("accused_father_name", "Nullable(String)"),
+            ("amount", "Int32"),
+            ("challanStatus", "String"),
+            ("court_status", "Nullable(String)"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "(number)",
+    },
+    "rc_chassis": {
+        "columns": [
+            ("vehicle_num", "String"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "(vehicle_num)",
+    },
+    # Reverse lookup chassis/engine number -> rc_number
+    "vehicle_chassis_index": {
+        "columns": [
+            ("lookup_key", "String"),
+            ("lookup_key_rev", "String"),
+            ("key_type", "LowCardinality(String)"),
+            ("rc_number", "String"),
+            ("source", "LowCardinality(String)"),
+            ("updated_on", "DateTime"),
+        ],
+        # source is part of the key so each source's entry survives merges and the lookup can report it
+        "engine": "ReplacingMergeTree(updated_on)",
+        "order_by": "(lookup_key, key_type, rc_number, source)",
+    },
+    # Same rows ordered by the reversed key, so suffix matching is a prefix range scan.
+    # A separate table rather than a projection: recent ClickHouse rejects projections
+    # on ReplacingMergeTree unless deduplicate_merge_projection_mode is set.
+    "vehicle_chassis_suffix_index": {
+        "columns": [
+            ("lookup_key", "String"),
+            ("lookup_key_rev", "String"),
+            ("key_type", "LowCardinality(String)"),
+            ("rc_number", "String"),
+            ("source", "LowCardinality(String)"),
+            ("updated_on", "DateTime"),
+        ],
+        "engine": "ReplacingMergeTree(updated_on)",
+        "order_by": "(lookup_key_rev, key_type, rc_number, source)",
+    },
+    # Upcoming rc/insurance/pucc expiries from vehicle_rc_black_list, ordered by date;
+    # a vehicle's superseded dates are filtered at query time by latest updated_on
+    "vehicle_expiry_index": {
+        "columns": [
+            ("expiry_date", "Date"),
+            ("expiry_type", "LowCardinality(String)"),
+            ("regNo", "String"),
+            ("blacklistStatus", "String"),
+            # Server clock, so cursors are not skewed by the inserting worker's clock
+            ("updated_on", "DateTime64(3)", "now64(3)"),
+        ],
+        "indexes": ["regno_idx regNo TYPE bloom_filter GRANULARITY 4"],
+        "engine": "ReplacingMergeTree(updated_on)",
+        "order_by": "(expiry_date, expiry_type, regNo)",
+    },
+    # Keys inserted into the membership sets by any worker, polled by every worker's filters
+    "membership_recent_keys": {
+        "columns": [
+            ("set_name", "LowCardinality(String)"),
+            ("key", "String"),
+            ("inserted_on", "DateTime64(3)", "now64(3)"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "(set_name, inserted_on)",
+        "ttl": "toDateTime(inserted_on) + INTERVAL 1 DAY",
+    },
+    # Last cursor of each named expiry scanner, so restarts resume instead of re-alerting
+    "vehicle_expiry_scan_state": {
+        "columns": [
+            ("scanner", "String"),
+            ("cursor", "DateTime64(3)"),
+            ("updated_on", "DateTime64(3)", "now64(3)"),
+        ],
+        "engine": "ReplacingMergeTree(updated_on)",
+        "order_by": "scanner",
+    },
+    # Canonical vehicle key -> the raw key each source table stores for it
+    "vehicle_identity": {
+        "columns": [
+            ("canonical_key", "String"),
+            ("source", "LowCardinality(String)"),
+            ("source_key", "String"),
+            ("updated_on", "DateTime"),
+        ],
+        "engine": "ReplacingMergeTree(updated_on)",
+        "order_by": "(canonical_key, source, source_key)",
+    },
+    "vehicle_service_history": {
+        "columns": [
+            ("vehicleNumber", "String"),
+            ("register_no", "Nullable(String)"),
+            ("repair_order_no", "String", "''"),
+            ("repair_order_bill_no", "Nullable(String)"),
+            ("chassis_no", "Nullable(String)"),
+            ("location_code", "Nullable(String)"),
+            ("location_name", "Nullable(String)"),
+            ("dealer_code", "Nullable(String)"),
+            ("dealer_name", "Nullable(String)"),
+            ("svc_date", "Date", "toDate(0)"),
+            ("repair_order_bill_date", "Nullable(Date)"),
+            ("mileage", "Nullable(UInt32)"),
+            ("net_bill_amt", "Nullable(Float64)"),
+            ("out_standing_amt", "Nullable(Float64)"),
+            ("paid_amt", "Nullable(Float64)"),
+            ("online_payment_flag", "Nullable(String)"),
+            ("service_assistant_no", "Nullable(String)"),
+            ("service_assistant_name", "Nullable(String)"),
+            ("work_type", "Nullable(String)"),
+            ("status", "Nullable(String)"),
+            ("service_cate", "Nullable(String)"),
+            ("created_on", "DateTime", "now()"),
+            ("updated_on", "DateTime", "now()"),
+        ],
+        "engine": "MergeTree()",
+        "order_by": "(vehicleNumber, svc_date, repair_order_no)",
+        "settings": "index_granularity = 8192",
+    },
+}
+
+# Materialized views keep derived tables in step with their source table, as part of the same INSERT
+VIEW_SPECS = {
+    "vehicle_challan_violation_mv": {
+        "to": "vehicle_challan_violation",
+        "select": """
+            SELECT detailsViolation.offence AS offence, challanNo, nullIf(detailsViolation.penalty, '') AS penalty,
+                   dlRcNumber, rcNo, State, dateChallan
+            FROM vehicle_challan
+            ARRAY JOIN detailsViolation
+        """,
+    },
+}
+
+# "fail" aborts startup on drift, "migrate" adds missing columns, "off" skips the check
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "fail")
+
+def expand_columns(table):
+    """Physical (name, type) pairs of a table, with Nested columns flattened."""
+    columns = []
+    for column in TABLE_SPECS[table]["columns"]:
+        name, col_type = column[0], column[1]
+        if isinstance(col_type, list):
+            columns.extend((f"{name}.{sub}", f"Array({sub_type})") for sub, sub_type in col_type)
+        else:
+            columns.append((name, col_type))
+    return columns
+
+TABLE_COLUMNS = {table: [name for name, _ in expand_columns(table)] for table in TABLE_SPECS}
+
+def table_columns(table):
+    return TABLE_COLUMNS[table]
+
+def table_row(table, values):
+    """Order a column -> value dict by table's insert columns; every column must be given once."""
+    columns = TABLE_COLUMNS[table]
+    if len(values) != len(columns) or not all(column in values for column in columns):
+        raise RuntimeError(f"{table} row does not match TABLE_SPECS: missing {sorted(set(columns) - set(values))}, "
+                           f"unknown {sorted(set(values) - set(columns))}")
+    return [values[column] for column in columns]
+
+def column_definition(column):
+    name, col_type = column[0], column[1]
+    if isinstance(col_type, list):
+        col_type = "Nested(" + ", ".join(f"{sub} {sub_type}" for sub, sub_type in col_type) + ")"
+    if len(column) > 2:
+        col_type += f" DEFAULT {column[2]}"
+    return f"{name} {col_type}"
+
+def table_ddl(table):
+    spec = TABLE_SPECS[table]
+    definitions = [column_definition(column) for column in spec["columns"]]
+    definitions += [f"INDEX {index}" for index in spec.get("indexes", [])]
+    definitions += [f"PROJECTION {projection}" for projection in spec.get("projections", [])]
+    ddl = f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(definitions) + "\n)"
+    ddl += f" ENGINE = {spec['engine']} ORDER BY {spec['order_by']}"
+    if spec.get("ttl"):
+        ddl += f" TTL {spec['ttl']}"
+    if spec.get("settings"):
+        ddl += f" SETTINGS {spec['settings']}"
+    return ddl
+
+def view_ddl(view):
+    spec = VIEW_SPECS[view]
+    return f"CREATE MATERIALIZED VIEW IF NOT EXISTS {view} TO {spec['to']} AS {spec['select'].strip()}"
+
+ensured_tables = set()
+
+def create_table_if_not_exists(table):
+    # DDL runs once per process instead of on every request
+    if table in ensured_tables:
+        return
+    client.command(table_ddl(table))
+    ensured_tables.add(table)
+
+def create_view_if_not_exists(view):
+    # Never marked by the schema check, so an existing deployment gets the view on first use
+    if view in ensured_tables:
+        return
+    client.command(view_ddl(view))
+    ensured_tables.add(view)
+
 def create_fastag_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS fastag_details (
-            TagId String,
-            VRN String,
-            Tag_Status String,
-            Vehicle_Class String,
-            Action String,
-            Issue_Date Nullable(Date),
-            Issuer_Bank String,
-            Last_Update Nullable(DateTime),
-            created_on DateTime,
-            updated_on DateTime,
-            is_current UInt8,
-            is_changed UInt8,
-            dwid Nullable(String)
-        ) ENGINE = MergeTree()
-        ORDER BY TagId
-    """)
+    create_table_if_not_exists("fastag_details")
 
 def create_rc_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS vehicle_rc_v10 (
-            rc_number String,
-            registration_date Nullable(Date),
-            owner_name String,
-            father_name String,
-            present_address String,
-            permanent_address String,
-            mobile_number String,
-            vehicle_category String,
-            vehicle_chasi_number String,
-            vehicle_engine_number String,
-            maker_description String,
-            maker_model String,
-            body_type String,
-            fuel_type String,
-            color String,
-            norms_type String,
-            fit_up_to Nullable(Date),
-            financer String,
-            financed String,
-            insurance_company String,
-            insurance_policy_number String,
-            insurance_upto Nullable(Date),
-            manufacturing_date String,
-            manufacturing_date_formatted String,
-            registered_at String,
-            latest_by Nullable(DateTime),
-            less_info UInt8,
-            tax_upto Nullable(Date),
-            tax_paid_upto Nullable(Date),
-            cubic_capacity Nullable(Float32),
-            vehicle_gross_weight Nullable(Float32),
-            no_cylinders Nullable(UInt8),
-            seat_capacity Nullable(UInt8),
-            sleeper_capacity String,
-            standing_capacity String,
-            wheelbase String,
-            unladen_weight String,
-            vehicle_category_description String,
-            pucc_number String,
-            pucc_upto Nullable(Date),
-            permit_number String,
-            permit_issue_date String,
-            permit_valid_from String,
-            permit_valid_upto String,
-            permit_type String,
-            national_permit_number String,
-            national_permit_upto Nullable(Date),
-            national_permit_issued_by String,
-            non_use_status Nullable(UInt8),
-            non_use_from Nullable(Date),
-            non_use_to Nullable(Date),
-            blacklist_status String,
-            noc_details String,
-            owner_number String,
-            rc_status String,
-            masked_name UInt8,
-            variant Nullable(String),
-            permanent_Pincode String,
-            is_luxuryMover String,
-            make_Name String,
-            model_Name String,
-            variant_Name String,
-            statusAsOn String,
-            isCommercial String,
-            manufacture_Year String,
-            purchase_Date String,
-            rto_Code String,
-            rto_Name String,
-            regAuthority String,
-            rcStandardCap String,
-            blacklistDetails String,
-            dbResult String,
-            result String,
-            recommended_Vehicle String,
-            carVariant String,
-            cityofRegitration String,
-            cityofRegitrationId String,
-            manufactureMonth String,
-            expiryDuration String,
-            city String,
-            year String,
-            status String,
-            created_on DateTime,
-            updated_on DateTime
-        ) ENGINE = MergeTree()
-        ORDER BY rc_number
-    """)
+    create_table_if_not_exists("vehicle_rc_v10")
 
 def create_vehicle_challan_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS vehicle_challan (
-            forChallan Nullable(String),
-            typeAccused Nullable(String),
-            nameViolator Nullable(String),
-            violatorFatherName Nullable(String),
-            violatorContactNo Nullable(String),
-            dlRcNumber String,
-            challanNo String,
-            State String,
-            dateChallan Nullable(DateTime),
-            detailsViolation Nested(
-                offence String,
-                penalty Nullable(String)
-            ),
-            investigateUnder Nullable(String),
-            longLat Nullable(String),
-            locationChallan Nullable(String),
-            remarkChallan Nullable(String),
-            typeBook Nullable(String),
-            bookNo Nullable(String),
-            formNo Nullable(String),
-            witness1 Nullable(String),
-            witness2 Nullable(String),
-            witness3 Nullable(String),
-            imagesChallan Nullable(String),
-            imageVehicle Nullable(String),
-            imageCCTV1 Nullable(String),
-            imageCCTV2 Nullable(String),
-            numberDL Nullable(String),
-            detailsDL Nullable(String),
-            suspendISDL Nullable(String),
-            accNameDL Nullable(String),
-            accAddressDL Nullable(String),
-            accFatherNameDL Nullable(String),
-            accAgeDL Nullable(String),
-            accGenderDL Nullable(String),
-            validityDL Nullable(String),
-            issueDateDL Nullable(String),
-            issuedByDL Nullable(String),
-            amountChallan UInt32,
-            status String,
-            sourcePayment Nullable(String),
-            datePayment Nullable(String),
-            IDTransaction Nullable(String),
-            noReceipt Nullable(String),
-            noReceiptOffline Nullable(String),
-            receiptOffline Nullable(String),
-            noMobile Nullable(String),
-            byPayment Nullable(String),
-            acfIS Nullable(String),
-            amountACF Nullable(UInt32),
-            noReceiptACF Nullable(String),
-            nameRTO Nullable(String),
-            impoundDocument Nullable(String),
-            impoundVehicle Nullable(String),
-            classVehicle Nullable(String),
-            typeVehicle Nullable(String),
-            uptoVehicle Nullable(String),
-            uptoPermit Nullable(String),
-            rcNo String,
-            noChassis Nullable(String),
-            noEngine Nullable(String),
-            noVehOwner Nullable(String),
-            nameOwner Nullable(String),
-            nameFatherOwner Nullable(String),
-            addressOwner Nullable(String),
-            idCourt Nullable(String),
-            statusCourt Nullable(String),
-            idCourtRelated Nullable(String),
-            imgOrderRelease Nullable(String),
-            dateRelease Nullable(String),
-            noReceiptCourt Nullable(String),
-            byAction Nullable(String),
-            noDispatch Nullable(String),
-            nameCourt Nullable(String),
-            chargesUser Nullable(String),
-            challan_search_source Nullable(String),
-            court_status_desc Nullable(String)
-        ) ENGINE = MergeTree
-        ORDER BY challanNo;
-    """)
-def create_vehicle_rc_black_list_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS vehicle_rc_black_list (
-            regNo String,
-            stateCode String,
-            regDate Date,
-            vehicleClass String,
-            classCode String,
-            model String,
-            fuelType String,
-            owner String,
-            rcExpiryDate Date,
-            vehicleTaxUpto String,
-            emissionNorms String,
-            normsCode String,
-            insurance_companyName String,
-            insurance_validUpto Date,
-            financier_name String,
-            financedFrom String,
-            registrationAuthority String,
-            puccUpto String,
-            blacklistStatus String,
-            nocDetails String,
-            status String,
-            statusAsOn Date
-        ) ENGINE = MergeTree()
-        ORDER BY (regNo)
-    """) 
- 
+    create_table_if_not_exists("vehicle_challan")
+    # The view must exist before the first challan insert, or its violations are never fanned out
+    create_table_if_not_exists("vehicle_challan_violation")
+    create_view_if_not_exists("vehicle_challan_violation_mv")
 
+def create_vehicle_rc_black_list_table_if_not_exists():
+    create_table_if_not_exists("vehicle_rc_black_list")
 
 def create_vehicle_challan_all_state_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS vehicle_challan_all_state (
-            number Int32,
-            challanNumber String,
-            offenseDetails String,
-            challanPlace String,
-            payment_url Nullable(String),
-            image_url Nullable(String),
-            challanDate Date,
-            state String,
-            rto String,
-            accusedName String,
-            accused_father_name Nullable(String),
-            amount Int32,
-            challanStatus String,
-            court_status Nullable(String)
-        ) ENGINE = MergeTree()
-        ORDER BY (number)
-    """)
+    create_table_if_not_exists("vehicle_challan_all_state")
 
 def create_rc_chassis_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS rc_chassis (
-            vehicle_num String
-        ) ENGINE = MergeTree()
-        ORDER BY (vehicle_num)
-    """)
-
-def create_vehicle_service_history_table_if_not_exists():
-    client.command("""
-        CREATE TABLE IF NOT EXISTS vehicle_service_history (
-            vehicleNumber String,
-            register_no Nullable(String),
-            repair_order_no String DEFAULT '',
-            repair_order_bill_no Nullable(String),
-            chassis_no Nullable(String),
-            location_code Nullable(String),
-            location_name Nullable(String),
-            dealer_code Nullable(String),
-            dealer_name Nullable(String),
-            svc_date Date DEFAULT toDate(0),
-            repair_order_bill_date Nullable(Date),
-            mileage Nullable(UInt32),
-            net_bill_amt Nullable(Float64),
-            out_standing_amt Nullable(Float64),
-            paid_amt Nullable(Float64),
-            online_payment_flag Nullable(String),
-            service_assistant_no Nullable(String),
-            service_assistant_name Nullable(String),
-            work_type Nullable(String),
-            status Nullable(String),
-            service_cate Nullable(String),
-            created_on DateTime DEFAULT now(),
-            updated_on DateTime DEFAULT now()
-        )
-        ENGINE = MergeTree()
-        ORDER BY (vehicleNumber, svc_date, repair_order_no)
-        SETTINGS index_granularity = 8192
-    """)
-
+    create_table_if_not_exists("rc_chassis")
 
+def create_vehicle_chassis_index_table_if_not_exists():
+    create_table_if_not_exists("vehicle_chassis_index")
+    create_table_if_not_exists("vehicle_chassis_suffix_index")
 
+def create_vehicle_expiry_index_table_if_not_exists():
+    create_table_if_not_exists("vehicle_expiry_index")
 
+def create_vehicle_expiry_scan_state_table_if_not_exists():
+    create_table_if_not_exists("vehicle_expiry_scan_state")
 
+def create_vehicle_identity_table_if_not_exists():
+    create_table_if_not_exists("vehicle_identity")
 
+def create_vehicle_service_history_table_if_not_exists():
+    create_table_if_not_exists("vehicle_service_history")
+
+def verify_table_schemas():
+    """Compare live tables against TABLE_SPECS; fail fast or add missing columns."""
+    if SCHEMA_CHECK == "off":
+        return
+    result = client.query("""
+        SELECT table, name, type FROM system.columns
+        WHERE database = currentDatabase() AND table IN {tables:Array(String)}
+    """, parameters={"tables": list(TABLE_SPECS)})
+    live = {}
+    for table, name, col_type in result.result_rows:
+        live.setdefault(table, {})[name] = col_type
+
+    problems = []
+    for table in TABLE_SPECS:
+        if table not in live:
+            continue  # created on first use
+        defaults = {c[0]: c[2] for c in TABLE_SPECS[table]["columns"] if len(c) > 2}
+        for name, col_type in expand_columns(table):
+            live_type = live[table].get(name)
+            if live_type is None and SCHEMA_CHECK == "migrate":
+                default = f" DEFAULT {defaults[name]}" if name in defaults else ""
+                client.command(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS `{name}` {col_type}{default}")
+                logging.info("Added missing column %s.%s %s", table, name, col_type)
+            elif live_type is None:
+                problems.append(f"{table}.{name}: missing (expected {col_type})")
+            elif live_type != col_type:
+                problems.append(f"{table}.{name}: live type {live_type}, expected {col_type}")
+        ensured_tables.add(table)
+    if problems:
+        raise RuntimeError("ClickHouse schema drift detected:\n" + "\n".join(problems))
+
+# Derived tables are only maintained for rows ingested after they exist; a backfill fills
+# them from what the source tables already hold. Each is safe to re-run. "ensure" creates
+# the source and target tables; "sql" is one statement or a list run in order.
+BACKFILLS = {
+    "vehicle_challan_violation": {
+        "ensure": [create_vehicle_challan_table_if_not_exists],
+        "sql": f"""
+            INSERT INTO vehicle_challan_violation ({", ".join(table_columns("vehicle_challan_violation"))})
+            {VIEW_SPECS["vehicle_challan_violation_mv"]["select"].strip()}
+            WHERE challanNo NOT IN (SELECT challanNo FROM vehicle_challan_violation)
+        """,
+    },
+    # The same entries index_chassis_keys writes on ingest; re-running only replaces them
+    "vehicle_chassis_index": {
+        "ensure": [create_rc_table_if_not_exists, create_vehicle_service_history_table_if_not_exists,
+                   create_vehicle_chassis_index_table_if_not_exists],
+        "sql": [
+            f"""
+            INSERT INTO vehicle_chassis_index ({", ".join(table_columns("vehicle_chassis_index"))})
+            SELECT lookup_key, reverse(lookup_key), key_type, rc_number, source, updated_on
+            FROM (
+                SELECT upper(trimBoth(vehicle_chasi_number)) AS lookup_key, 'chassis' AS key_type, rc_number,
+                       'vehicle_rc_v10' AS source, updated_on
+                FROM vehicle_rc_v10
+                UNION ALL
+                SELECT upper(trimBoth(vehicle_engine_number)), 'engine', rc_number, 'vehicle_rc_v10', updated_on
+                FROM vehicle_rc_v10
+                UNION ALL
+                SELECT upper(trimBoth(ifNull(chassis_no, ''))), 'chassis', vehicleNumber, 'vehicle_service_history', updated_on
+                FROM vehicle_service_history
+            )
+            WHERE lookup_key != '' AND rc_number != ''
+            """,
+            f"""
+            INSERT INTO vehicle_chassis_suffix_index ({", ".join(table_columns("vehicle_chassis_suffix_index"))})
+            SELECT {", ".join(table_columns("vehicle_chassis_suffix_index"))} FROM vehicle_chassis_index
+            """,
+        ],
+    },
+    # Latest expiries of vehicles not indexed yet; they reach the next scan as new changes
+    "vehicle_expiry_index": {
+        "ensure": [create_vehicle_rc_black_list_table_if_not_exists, create_vehicle_expiry_index_table_if_not_exists],
+        "sql": """
+            INSERT INTO vehicle_expiry_index (expiry_date, expiry_type, regNo, blacklistStatus)
+            SELECT expiry.2, expiry.1, regNo, latest_status
+            FROM (
+                SELECT regNo, argMax(blacklistStatus, statusAsOn) AS latest_status,
+                       [('rc', argMax(rcExpiryDate, statusAsOn)),
+                        ('insurance', argMax(insurance_validUpto, statusAsOn)),
+                        ('pucc', toDate(parseDateTimeBestEffortOrZero(argMax(puccUpto, statusAsOn))))] AS expiries
+                FROM vehicle_rc_black_list
+                WHERE regNo NOT IN (SELECT regNo FROM vehicle_expiry_index)
+                GROUP BY regNo
+            )
+            ARRAY JOIN expiries AS expiry
+            WHERE expiry.2 > toDate(0)
+        """,
+    },
+}
+# Backfills scan whole source tables; progress headers keep the HTTP connection alive meanwhile
+BACKFILL_SETTINGS = {"max_execution_time": 0, "send_progress_in_http_headers": 1, "http_headers_progress_interval_ms": "10000"}
+
+def run_backfill(table):
+    """Fill a derived table from its source table's existing rows."""
+    backfill = BACKFILLS[table]
+    for ensure in backfill["ensure"]:
+        ensure()
+    start = time.perf_counter()
+    statements = backfill["sql"] if isinstance(backfill["sql"], list) else [backfill["sql"]]
+    for sql in statements:
+        client.command(sql, settings=BACKFILL_SETTINGS)
+    logging.info("Backfilled %s in %.1fs", table, time.perf_counter() - start)
+
+# INSERT_MODE=async uses server-side async_insert for the high-frequency single-row tables
+INSERT_MODE = os.getenv("INSERT_MODE", "sync")
+ASYNC_INSERT_WAIT = os.getenv("ASYNC_INSERT_WAIT", "1") == "1"
+ASYNC_INSERT_TABLES = {
+    "fastag_details": {"async_insert_busy_timeout_ms": 200, "async_insert_max_data_size": 1048576},
+    "rc_chassis": {"async_insert_busy_timeout_ms": 200, "async_insert_max_data_size": 262144},
+    "vehicle_challan_all_state": {"async_insert_busy_timeout_ms": 500, "async_insert_max_data_size": 2097152},
+    "membership_recent_keys": {"async_insert_busy_timeout_ms": 200, "async_insert_max_data_size": 262144},
+    "vehicle_identity": {"async_insert_busy_timeout_ms": 200, "async_insert_max_data_size": 262144},
+}
+
+def insert_settings(table):
+    """Settings and durability label for inserts into table."""
+    if INSERT_MODE != "async" or table not in ASYNC_INSERT_TABLES:
+        return None, "sync"
+    settings = {
+        "async_insert": 1,
+        "wait_for_async_insert": 1 if ASYNC_INSERT_WAIT else 0,
+        **ASYNC_INSERT_TABLES[table],
+    }
+    # Without waiting the row is only buffered server-side when we respond
+    return settings, "async_wait" if ASYNC_INSERT_WAIT else "async_nowait"
+
+def insert_rows(table, rows, column_names=None):
+    settings, durability = insert_settings(table)
+    client.insert(table, rows, column_names=column_names or table_columns(table), settings=settings)
+    return durability
+
+def column_converter(col_type):
+    """Value conversion for a request field stored in a column of col_type."""
+    nullable = col_type.startswith("Nullable(")
+    base = col_type[len("Nullable("):-1] if nullable else col_type
+    if base == "Date":
+        return parse_date
+    if base == "DateTime":
+        return parse_datetime
+    if base.startswith("Float"):
+        return safe_float
+    if base == "UInt8" and not nullable:
+        return bool_to_uint8
+    if base.startswith(("UInt", "Int")):
+        return safe_int
+    return lambda value: value or ""
+
+# Models whose field names are the table's column names
+MODEL_TABLES = [
+    (VehicleRCData, "vehicle_rc_v10"),
+    (ChallanRecord, "vehicle_challan"),
+    (VehicleRCBlackList, "vehicle_rc_black_list"),
+    (VehicleChallanAllState, "vehicle_challan_all_state"),
+    (RcChassis, "rc_chassis"),
+]
+
+for model, table in MODEL_TABLES:
+    unmapped = set(model.__fields__) - {column[0] for column in TABLE_SPECS[table]["columns"]}
+    if unmapped:
+        raise RuntimeError(f"{model.__name__} fields without a column in {table}: {sorted(unmapped)}")
+
+RC_COLUMN_TYPES = dict(expand_columns("vehicle_rc_v10"))
+RC_CONVERTERS = [(field, column_converter(RC_COLUMN_TYPES[field])) for field in VehicleRCData.__fields__]
 
 # ----------------------------
 # Endpoints
@@ -624,7 +1367,9 @@ def create_vehicle_service_history_table_if_not_exists():
 @app.get("/")
 async def health():
     return {"status": "ok", "service": "Vehicle Data API", "endpoints": ["/add_fastag", "/add_vehicle_rc", "/add_challan_record",
-    "/add_vehicle_rc_black_list" ,"/add_vehicle_challan_all_state", "/add_rc_chassis", "/add_mahindra_service"]}
+    "/add_vehicle_rc_black_list" ,"/add_vehicle_challan_all_state", "/add_rc_chassis", "/add_mahindra_service",
+    "/vehicle/{number}", "/rc_chassis/lookup", "/export/challans_all_state", "/export/challans", "/export/rc",
+    "/blobs/{digest}", "/expiries", "/exists", "/identity/{key}"]}
 
 
   ##### Vehicle Fastag Detailed V1 API ######
@@ -637,60 +1382,68 @@ async def add_fastag(data: FastagData):
 #    # if client.query(f"SELECT count() FROM fastag_details WHERE TagId='{data.TagId}' AND VRN='{data.VRN}'").result_rows[0][0] > 0:
 #         raise HTTPException(status_code=409, detail="Duplicate FASTag entry")
 
-    row = [
-        data.TagId,
-        data.VRN,
-        data.TagStatus or "",
-        data.VehicleClass or "",
-        data.Action or "",
-        parse_date(data.IssueDate),
-        data.IssuerBank or "",
-        parse_datetime(data.LastUpdate),
-        now, now, 1, 0, None
-    ]
-    client.insert("fastag_details", [row], column_names=[
-        "TagId","VRN","Tag_Status","Vehicle_Class","Action","Issue_Date",
-        "Issuer_Bank","Last_Update","created_on","updated_on","is_current","is_changed","dwid"
-    ])
-    return {"message": "FASTag data inserted successfully", "TagId": data.TagId, "VRN": data.VRN}
+    row = table_row("fastag_details", {
+        "TagId": data.TagId,
+        "VRN": data.VRN,
+        "Tag_Status": data.TagStatus or "",
+        "Vehicle_Class": data.VehicleClass or "",
+        "Action": data.Action or "",
+        "Issue_Date": parse_date(data.IssueDate),
+        "Issuer_Bank": data.IssuerBank or "",
+        "Last_Update": parse_datetime(data.LastUpdate),
+        "created_on": now,
+        "updated_on": now,
+        "is_current": 1,
+        "is_changed": 0,
+        "dwid": None,
+    })
+    durability = insert_rows("fastag_details", [row])
+    record_identity("fastag_details", [data.VRN])
+    membership_sets["fastag"].record(data.VRN)
+    return {"message": "FASTag data inserted successfully", "TagId": data.TagId, "VRN": data.VRN,
+            "durability": durability}
 
 ##### Vehicle RC V10 (Additional Details) ######
 
 @app.post("/add_vehicle_rc")
 async def add_vehicle_rc(data: VehicleRCData):
+    mark_stage("validate")
     create_rc_table_if_not_exists()
+    mark_stage("ddl")
     now = datetime.now()
     # Duplicate check
     # if client.query(f"SELECT count() FROM vehicle_rc_v10 WHERE rc_number='{data.rc_number}'").result_rows[0][0] > 0:
     #     raise HTTPException(status_code=409, detail="Duplicate RC entry")
 
-    row = []
-    for field_name in list(VehicleRCData.__fields__.keys()):
-        value = getattr(data, field_name)
-        if field_name in ["registration_date","fit_up_to","insurance_upto","tax_upto","tax_paid_upto","pucc_upto","national_permit_upto","non_use_from","non_use_to"]:
-            row.append(parse_date(value))
-        elif field_name in ["latest_by"]:
-            row.append(parse_datetime(value))
-        elif field_name in ["cubic_capacity","vehicle_gross_weight"]:
-            row.append(safe_float(value))
-        elif field_name in ["no_cylinders","seat_capacity","non_use_status"]:
-            row.append(safe_int(value))
-        elif field_name in ["less_info","masked_name"]:
-            row.append(bool_to_uint8(value))
-        else:
-            row.append(value or "")
-    row.extend([now, now])
-    columns = list(VehicleRCData.__fields__.keys()) + ["created_on", "updated_on"]
-    client.insert("vehicle_rc_v10", [row], column_names=columns)
+    values = {field: convert(getattr(data, field)) for field, convert in RC_CONVERTERS}
+    row = table_row("vehicle_rc_v10", {**values, "created_on": now, "updated_on": now})
+    mark_stage("encode")
+    client.insert("vehicle_rc_v10", [row], column_names=table_columns("vehicle_rc_v10"))
+    mark_stage("insert")
+    record_identity("vehicle_rc_v10", [data.rc_number])
+    mark_stage("identity")
+    index_chassis_keys([
+        (data.vehicle_chasi_number, "chassis", data.rc_number),
+        (data.vehicle_engine_number, "engine", data.rc_number),
+    ], source="vehicle_rc_v10")
+    mark_stage("index")
     return {"message": "RC data inserted successfully", "rc_number": data.rc_number}
 
 
 ##### Vehicle Challan Detailed API ######
 
+CHALLAN_BLOB_FIELDS = ["imagesChallan", "imageVehicle", "imageCCTV1", "imageCCTV2", "imgOrderRelease"]
+
+def offload_challan_blobs(data):
+    # Store I/O (S3 or disk) is blocking; callers run this off the event loop
+    return {field: offload_blob(getattr(data, field)) for field in CHALLAN_BLOB_FIELDS}
+
 
 @app.post("/add_challan_record")
 async def add_challan_record(data: ChallanRecord):
+    mark_stage("validate")
     create_vehicle_challan_table_if_not_exists()
+    mark_stage("ddl")
 
     # Ensure nested arrays are not None
     dv = data.detailsViolation or []
@@ -708,101 +1461,110 @@ async def add_challan_record(data: ChallanRecord):
 
    
 
-    row = [
-        data.forChallan or None,                
-        data.typeAccused or None,                
-        data.nameViolator or "",                
-        data.violatorFatherName or None,         
-        data.violatorContactNo or None,          
-        data.dlRcNumber or "",                   
-        data.challanNo or "",                    
-        data.State or "",                        
-        dt,                                      
-        detailsViolation_offence,               
-        detailsViolation_penalty,                
-        data.investigateUnder or None,
-        data.longLat or None,
-        data.locationChallan or None,
-        data.remarkChallan or None,
-        data.typeBook or None,
-        data.bookNo or None,
-        data.formNo or None,
-        data.witness1 or None,
-        data.witness2 or None,
-        data.witness3 or None,
-        data.imagesChallan or None,
-        data.imageVehicle or None,
-        data.imageCCTV1 or None,
-        data.imageCCTV2 or None,
-        data.numberDL or None,
-        data.detailsDL or None,
-        data.suspendISDL or None,
-        data.accNameDL or None,
-        data.accAddressDL or None,
-        data.accFatherNameDL or None,
-        data.accAgeDL or None,
-        data.accGenderDL or None,
-        data.validityDL or None,
-        data.issueDateDL or None,
-        data.issuedByDL or None,
-        int(data.amountChallan or 0),            
-        data.status or "",                      
-        data.sourcePayment or None,
-        data.datePayment or None,
-        data.IDTransaction or None,
-        data.noReceipt or None,
-        data.noReceiptOffline or None,
-        data.receiptOffline or None,
-        data.noMobile or None,
-        data.byPayment or None,
-        data.acfIS or None,
-        int(data.amountACF or 0),                
-        data.noReceiptACF or None,
-        data.nameRTO or None,
-        data.impoundDocument or None,
-        data.impoundVehicle or None,
-        data.classVehicle or None,
-        data.typeVehicle or None,
-        data.uptoVehicle or None,
-        data.uptoPermit or None,
-        data.rcNo or "",                         
-        data.noChassis or None,
-        data.noEngine or None,
-        data.noVehOwner or None,
-        data.nameOwner or None,
-        data.nameFatherOwner or None,
-        data.addressOwner or None,
-        data.idCourt or None,
-        data.statusCourt or None,
-        data.idCourtRelated or None,
-        data.imgOrderRelease or None,
-        data.dateRelease or None,
-        data.noReceiptCourt or None,
-        data.byAction or None,
-        data.noDispatch or None,
-        data.nameCourt or None,
-        data.chargesUser or None,
-        data.challan_search_source or None,
-        data.court_status_desc or None,
-    ]
-
-    client.insert("vehicle_challan", [row], column_names=[
-        "forChallan","typeAccused","nameViolator","violatorFatherName","violatorContactNo",
-        "dlRcNumber","challanNo","State","dateChallan",
-        "detailsViolation.offence","detailsViolation.penalty",
-        "investigateUnder","longLat","locationChallan","remarkChallan","typeBook","bookNo","formNo",
-        "witness1","witness2","witness3","imagesChallan","imageVehicle","imageCCTV1","imageCCTV2",
-        "numberDL","detailsDL","suspendISDL","accNameDL","accAddressDL","accFatherNameDL","accAgeDL",
-        "accGenderDL","validityDL","issueDateDL","issuedByDL","amountChallan","status","sourcePayment",
-        "datePayment","IDTransaction","noReceipt","noReceiptOffline","receiptOffline","noMobile","byPayment",
-        "acfIS","amountACF","noReceiptACF","nameRTO","impoundDocument","impoundVehicle","classVehicle",
-        "typeVehicle","uptoVehicle","uptoPermit","rcNo","noChassis","noEngine","noVehOwner",
-        "nameOwner","nameFatherOwner","addressOwner","idCourt","statusCourt","idCourtRelated","imgOrderRelease",
-        "dateRelease","noReceiptCourt","byAction","noDispatch","nameCourt","chargesUser",
-        "challan_search_source","court_status_desc"
-    ])
+    # Large embedded images go to the blob store; the row keeps only the reference
+    images = await asyncio.to_thread(offload_challan_blobs, data)
+    mark_stage("blobs")
+
+    row = table_row("vehicle_challan", {
+        "forChallan": data.forChallan or None,
+        "typeAccused": data.typeAccused or None,
+        "nameViolator": data.nameViolator or "",
+        "violatorFatherName": data.violatorFatherName or None,
+        "violatorContactNo": data.violatorContactNo or None,
+        "dlRcNumber": data.dlRcNumber or "",
+        "challanNo": data.challanNo or "",
+        "State": data.State or "",
+        "dateChallan": dt,
+        "detailsViolation.offence": detailsViolation_offence,
+        "detailsViolation.penalty": detailsViolation_penalty,
+        "investigateUnder": data.investigateUnder or None,
+        "longLat": data.longLat or None,
+        "locationChallan": data.locationChallan or None,
+        "remarkChallan": data.remarkChallan or None,
+        "typeBook": data.typeBook or None,
+        "bookNo": data.bookNo or None,
+        "formNo": data.formNo or None,
+        "witness1": data.witness1 or None,
+        "witness2": data.witness2 or None,
+        "witness3": data.witness3 or None,
+        "imagesChallan": images["imagesChallan"] or None,
+        "imageVehicle": images["imageVehicle"] or None,
+        "imageCCTV1": images["imageCCTV1"] or None,
+        "imageCCTV2": images["imageCCTV2"] or None,
+        "numberDL": data.numberDL or None,
+        "detailsDL": data.detailsDL or None,
+        "suspendISDL": data.suspendISDL or None,
+        "accNameDL": data.accNameDL or None,
+        "accAddressDL": data.accAddressDL or None,
+        "accFatherNameDL": data.accFatherNameDL or None,
+        "accAgeDL": data.accAgeDL or None,
+        "accGenderDL": data.accGenderDL or None,
+        "validityDL": data.validityDL or None,
+        "issueDateDL": data.issueDateDL or None,
+        "issuedByDL": data.issuedByDL or None,
+        "amountChallan": int(data.amountChallan or 0),
+        "status": data.status or "",
+        "sourcePayment": data.sourcePayment or None,
+        "datePayment": data.datePayment or None,
+        "IDTransaction": data.IDTransaction or None,
+        "noReceipt": data.noReceipt or None,
+        "noReceiptOffline": data.noReceiptOffline or None,
+        "receiptOffline": data.receiptOffline or None,
+        "noMobile": data.noMobile or None,
+        "byPayment": data.byPayment or None,
+        "acfIS": data.acfIS or None,
+        "amountACF": int(data.amountACF or 0),
+        "noReceiptACF": data.noReceiptACF or None,
+        "nameRTO": data.nameRTO or None,
+        "impoundDocument": data.impoundDocument or None,
+        "impoundVehicle": data.impoundVehicle or None,
+        "classVehicle": data.classVehicle or None,
+        "typeVehicle": data.typeVehicle or None,
+        "uptoVehicle": data.uptoVehicle or None,
+        "uptoPermit": data.uptoPermit or None,
+        "rcNo": data.rcNo or "",
+        "noChassis": data.noChassis or None,
+        "noEngine": data.noEngine or None,
+        "noVehOwner": data.noVehOwner or None,
+        "nameOwner": data.nameOwner or None,
+        "nameFatherOwner": data.nameFatherOwner or None,
+        "addressOwner": data.addressOwner or None,
+        "idCourt": data.idCourt or None,
+        "statusCourt": data.statusCourt or None,
+        "idCourtRelated": data.idCourtRelated or None,
+        "imgOrderRelease": images["imgOrderRelease"] or None,
+        "dateRelease": data.dateRelease or None,
+        "noReceiptCourt": data.noReceiptCourt or None,
+        "byAction": data.byAction or None,
+        "noDispatch": data.noDispatch or None,
+        "nameCourt": data.nameCourt or None,
+        "chargesUser": data.chargesUser or None,
+        "challan_search_source": data.challan_search_source or None,
+        "court_status_desc": data.court_status_desc or None,
+    })
+
+    mark_stage("encode")
+    # vehicle_challan_violation_mv fans detailsViolation out to vehicle_challan_violation within this INSERT
+    client.insert("vehicle_challan", [row], column_names=table_columns("vehicle_challan"))
+    mark_stage("insert")
+    record_identity("vehicle_challan", [data.rcNo, data.dlRcNumber])
+    mark_stage("identity")
     return {"message": "Challan record inserted successfully", "challanNo": data.challanNo}
 
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str):
+    if digest.startswith(BLOB_REF_PREFIX):
+        digest = digest[len(BLOB_REF_PREFIX):]
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=422, detail="digest must be a sha256 hex string")
+    if blob_store is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    data = await asyncio.to_thread(blob_store.get, digest)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    # Content-addressed, so the body for a digest never changes
+    return Response(content=data, media_type="text/plain", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
 
 ####### Vehicle RC - Blacklist Status & Insurance Check #####
 
@@ -812,38 +1574,173 @@ async def add_vehicle_rc_black_list(data: VehicleRCBlackList):
     # Duplicate check
     # if client.query(f"SELECT count() FROM vehicle_rc_black_list WHERE regNo='{data.regNo}'").result_rows[0][0] > 0:
     #     raise HTTPException(status_code=409, detail="Duplicate blacklist entry")
-    row = [
-        data.regNo,
-        data.stateCode,
-        parse_date(data.regDate),
-        data.vehicleClass,
-        data.classCode,
-        data.model,
-        data.fuelType,
-        data.owner,
-        parse_date(data.rcExpiryDate),
-        data.vehicleTaxUpto,
-        data.emissionNorms,
-        data.normsCode,
-        data.insurance_companyName,
-        parse_date(data.insurance_validUpto),
-        data.financier_name,
-        data.financedFrom,
-        data.registrationAuthority,
-        data.puccUpto,
-        data.blacklistStatus,
-        data.nocDetails,
-        data.status,
-        parse_date(data.statusAsOn)
-    ]
-    client.insert("vehicle_rc_black_list", [row], column_names=[
-        "regNo", "stateCode", "regDate", "vehicleClass", "classCode", "model",
-        "fuelType", "owner", "rcExpiryDate", "vehicleTaxUpto", "emissionNorms", "normsCode",
-        "insurance_companyName", "insurance_validUpto", "financier_name", "financedFrom",
-        "registrationAuthority", "puccUpto", "blacklistStatus", "nocDetails", "status", "statusAsOn"
-    ])
+    row = table_row("vehicle_rc_black_list", {
+        "regNo": data.regNo,
+        "stateCode": data.stateCode,
+        "regDate": parse_date(data.regDate),
+        "vehicleClass": data.vehicleClass,
+        "classCode": data.classCode,
+        "model": data.model,
+        "fuelType": data.fuelType,
+        "owner": data.owner,
+        "rcExpiryDate": parse_date(data.rcExpiryDate),
+        "vehicleTaxUpto": data.vehicleTaxUpto,
+        "emissionNorms": data.emissionNorms,
+        "normsCode": data.normsCode,
+        "insurance_companyName": data.insurance_companyName,
+        "insurance_validUpto": parse_date(data.insurance_validUpto),
+        "financier_name": data.financier_name,
+        "financedFrom": data.financedFrom,
+        "registrationAuthority": data.registrationAuthority,
+        "puccUpto": data.puccUpto,
+        "blacklistStatus": data.blacklistStatus,
+        "nocDetails": data.nocDetails,
+        "status": data.status,
+        "statusAsOn": parse_date(data.statusAsOn),
+    })
+    client.insert("vehicle_rc_black_list", [row], column_names=table_columns("vehicle_rc_black_list"))
+    record_identity("vehicle_rc_black_list", [data.regNo])
+    index_expiries(data)
+    membership_sets["blacklist"].record(data.regNo)
     return {"message": "RC blacklist entry inserted successfully", "regNo": data.regNo}
 
+EXPIRY_TYPES = {"rc": "rcExpiryDate", "insurance": "insurance_validUpto", "pucc": "puccUpto"}
+EXPIRY_SCAN_INTERVAL = float(os.getenv("EXPIRY_SCAN_INTERVAL", "0"))
+EXPIRY_SCAN_DAYS = int(os.getenv("EXPIRY_SCAN_DAYS", "30"))
+EXPIRY_ALERT_WEBHOOK = os.getenv("EXPIRY_ALERT_WEBHOOK")
+EXPIRY_EPOCH = "1970-01-01 00:00:00.000"
+# Rows younger than this are not returned yet, so an insert that commits late cannot
+# land behind a cursor that has already moved past it
+EXPIRY_CURSOR_LAG = int(os.getenv("EXPIRY_CURSOR_LAG", "30"))
+EXPIRY_SCANNER = os.getenv("EXPIRY_SCANNER", "default")
+EXPIRY_SCAN_LOCK = os.getenv("EXPIRY_SCAN_LOCK", os.path.join(tempfile.gettempdir(), "vehicle_expiry_scan.lock"))
+EXPIRY_INDEX_COLUMNS = ["expiry_date", "expiry_type", "regNo", "blacklistStatus"]
+
+def expiry_cursor(row):
+    return row["updated_on"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+def latest_indexed_expiries(reg_no):
+    """{expiry_type: (expiry_date, blacklistStatus)} as last written to the index for reg_no."""
+    # Read on every call: any worker may have written this vehicle since, so a
+    # per-worker cache could skip a write the index still needs
+    result = client.query("""
+        SELECT expiry_type, argMax(expiry_date, updated_on), argMax(blacklistStatus, updated_on)
+        FROM vehicle_expiry_index
+        WHERE regNo = {reg_no:String}
+        GROUP BY expiry_type
+    """, parameters={"reg_no": reg_no})
+    return {row[0]: (row[1], row[2]) for row in result.result_rows}
+
+def index_expiries(data):
+    """Write only expiries whose date or status differs from the latest indexed one."""
+    create_vehicle_expiry_index_table_if_not_exists()
+    latest = latest_indexed_expiries(data.regNo)
+    rows = []
+    for expiry_type, field in EXPIRY_TYPES.items():
+        expiry_date = parse_date(getattr(data, field))
+        # Crawlers re-send unchanged records; re-indexing them would re-alert every scan
+        if expiry_date and latest.get(expiry_type) != (expiry_date, data.blacklistStatus):
+            rows.append([expiry_date, expiry_type, data.regNo, data.blacklistStatus])
+    if rows:
+        client.insert("vehicle_expiry_index", rows, column_names=EXPIRY_INDEX_COLUMNS)
+
+def upcoming_expiries(days, types, since, limit):
+    """Latest expiries within days from today that changed after since, oldest change first."""
+    create_vehicle_expiry_index_table_if_not_exists()
+    # WITH TIES keeps a whole insert batch (same updated_on) on one page so the cursor never splits it
+    return query_dicts("""
+        WITH candidates AS (
+            SELECT expiry_date, expiry_type, regNo, blacklistStatus, updated_on
+            FROM vehicle_expiry_index
+            WHERE expiry_date BETWEEN today() AND today() + {days:UInt32}
+              AND expiry_type IN {types:Array(String)}
+              AND updated_on > {since:DateTime64(3)}
+              AND updated_on < subtractSeconds(now64(3), {lag:UInt32})
+        )
+        SELECT * FROM candidates
+        WHERE (expiry_type, regNo, updated_on) IN (
+            SELECT expiry_type, regNo, max(updated_on)
+            FROM vehicle_expiry_index
+            WHERE regNo IN (SELECT regNo FROM candidates)
+            GROUP BY expiry_type, regNo
+        )
+        ORDER BY updated_on
+        LIMIT {limit:UInt32} WITH TIES
+    """, {"days": days, "types": types, "since": since, "limit": limit, "lag": EXPIRY_CURSOR_LAG})
+
+@app.get("/expiries")
+async def get_expiries(days: int = 30, types: str = "rc,insurance,pucc", since: Optional[str] = None, limit: int = 10000):
+    type_list = [t.strip() for t in types.split(",") if t.strip()]
+    if not type_list or any(t not in EXPIRY_TYPES for t in type_list):
+        raise HTTPException(status_code=422, detail=f"types must be a comma-separated subset of {list(EXPIRY_TYPES)}")
+    if not since:
+        since = EXPIRY_EPOCH
+    else:
+        cursor = parse_datetime(since)
+        if cursor is None or cursor.tzinfo is not None:
+            raise HTTPException(status_code=422, detail="since must be a next_since cursor ('YYYY-MM-DD HH:MM:SS.fff')")
+        since = cursor.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    rows = await asyncio.to_thread(upcoming_expiries, max(0, days), type_list, since, max(1, min(limit, 100000)))
+    next_since = expiry_cursor(rows[-1]) if rows else since
+    return {"days": days, "since": since, "next_since": next_since, "expiries": rows}
+
+def send_expiry_alert(rows):
+    if not EXPIRY_ALERT_WEBHOOK:
+        logging.info("Expiry scan: %d changed upcoming expiries", len(rows))
+        return
+    import urllib.request
+    body = json.dumps({"expiries": rows}, default=str).encode()
+    request = urllib.request.Request(EXPIRY_ALERT_WEBHOOK, data=body, headers={"Content-Type": "application/json"})
+    urllib.request.urlopen(request, timeout=10).close()
+
+def load_expiry_scan_cursor():
+    create_vehicle_expiry_scan_state_table_if_not_exists()
+    result = client.query(
+        "SELECT argMax(cursor, updated_on) FROM vehicle_expiry_scan_state WHERE scanner = {scanner:String}",
+        parameters={"scanner": EXPIRY_SCANNER},
+    )
+    cursor = result.result_rows[0][0] if result.result_rows else None
+    return cursor.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] if cursor else EXPIRY_EPOCH
+
+def save_expiry_scan_cursor(cursor):
+    client.insert("vehicle_expiry_scan_state", [[EXPIRY_SCANNER, datetime.strptime(cursor, "%Y-%m-%d %H:%M:%S.%f")]],
+                  column_names=["scanner", "cursor"])
+
+def acquire_expiry_scan_lock():
+    """Hold an exclusive file lock for the process lifetime; only the holder scans."""
+    import fcntl
+    lock_file = open(EXPIRY_SCAN_LOCK, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+async def expiry_scan_loop():
+    # One scanner per host via the file lock; across hosts, enable EXPIRY_SCAN_INTERVAL on
+    # one deployment only. The cursor lives in ClickHouse, so restarts resume where they stopped.
+    lock_file = acquire_expiry_scan_lock()
+    if lock_file is None:
+        logging.info("Expiry scan runs in another worker; not scanning here")
+        return
+    try:
+        while True:
+            await asyncio.sleep(EXPIRY_SCAN_INTERVAL)
+            try:
+                since = await asyncio.to_thread(load_expiry_scan_cursor)
+                while True:
+                    rows = await asyncio.to_thread(upcoming_expiries, EXPIRY_SCAN_DAYS, list(EXPIRY_TYPES), since, 10000)
+                    if not rows:
+                        break
+                    await asyncio.to_thread(send_expiry_alert, rows)
+                    since = expiry_cursor(rows[-1])
+                    await asyncio.to_thread(save_expiry_scan_cursor, since)
+            except Exception:
+                logging.exception("Expiry scan failed")
+    finally:
+        lock_file.close()
+
 #######  Vehicle Challan with all States and Interceptor Challans #####
 
 @app.post("/add_vehicle_challan_all_state")
@@ -852,28 +1749,26 @@ async def add_vehicle_challan_all_state(data: VehicleChallanAllState):
     # Duplicate check: assumes challanNumber is unique
     #if client.query(f"SELECT count() FROM vehicle_challan_all_state WHERE challanNumber='{data.challanNumber}'").result_rows[0][0] > 0:
         #raise HTTPException(status_code=409, detail="Duplicate challanNumber entry")
-    row = [
-        data.number,
-        data.challanNumber,
-        data.offenseDetails,
-        data.challanPlace,
-        data.payment_url,
-        data.image_url,
-        parse_date(data.challanDate),
-        data.state,
-        data.rto,
-        data.accusedName,
-        data.accused_father_name,
-        data.amount,
-        data.challanStatus,
-        data.court_status
-    ]
-    client.insert("vehicle_challan_all_state", [row], column_names=[
-        "number", "challanNumber", "offenseDetails", "challanPlace", "payment_url", "image_url",
-        "challanDate", "state", "rto", "accusedName", "accused_father_name",
-        "amount", "challanStatus", "court_status"
-    ])
-    return {"message": "Challan data inserted successfully", "challanNumber": data.challanNumber}
+    row = table_row("vehicle_challan_all_state", {
+        "number": data.number,
+        "challanNumber": data.challanNumber,
+        "offenseDetails": data.offenseDetails,
+        "challanPlace": data.challanPlace,
+        "payment_url": data.payment_url,
+        "image_url": data.image_url,
+        "challanDate": parse_date(data.challanDate),
+        "state": data.state,
+        "rto": data.rto,
+        "accusedName": data.accusedName,
+        "accused_father_name": data.accused_father_name,
+        "amount": data.amount,
+        "challanStatus": data.challanStatus,
+        "court_status": data.court_status,
+    })
+    durability = insert_rows("vehicle_challan_all_state", [row])
+    record_identity("vehicle_challan_all_state", [data.number])
+    return {"message": "Challan data inserted successfully", "challanNumber": data.challanNumber,
+            "durability": durability}
 
 
 ##### for Reverse RC Chassis to RC Live API #############
@@ -884,91 +1779,593 @@ async def add_rc_chassis(data: RcChassis):
     # Duplicate check
     # if client.query(f"SELECT count() FROM rc_chassis WHERE vehicle_num='{data.vehicle_num}'").result_rows[0][0] > 0:
     #     raise HTTPException(status_code=409, detail="Duplicate vehicle_num entry")
-    row = [
-        data.vehicle_num
-    ]
-    client.insert("rc_chassis", [row], column_names=[
-        "vehicle_num"
-    ])
-    return {"message": "RC chassis data inserted successfully", "vehicle_num": data.vehicle_num}
+    row = table_row("rc_chassis", {"vehicle_num": data.vehicle_num})
+    durability = insert_rows("rc_chassis", [row])
+    record_identity("rc_chassis", [data.vehicle_num])
+    membership_sets["rc_chassis"].record(data.vehicle_num)
+    return {"message": "RC chassis data inserted successfully", "vehicle_num": data.vehicle_num,
+            "durability": durability}
+
+CHASSIS_LOOKUP_MIN_SUFFIX = int(os.getenv("CHASSIS_LOOKUP_MIN_SUFFIX", "4"))
+
+@app.get("/rc_chassis/lookup")
+async def lookup_rc_chassis(key: str, match: str = "exact", key_type: Optional[str] = None, limit: int = 100):
+    key = normalize_lookup_key(key)
+    if match not in ("exact", "suffix"):
+        raise HTTPException(status_code=422, detail="match must be 'exact' or 'suffix'")
+    if key_type not in (None, "chassis", "engine"):
+        raise HTTPException(status_code=422, detail="key_type must be 'chassis' or 'engine'")
+    if match == "suffix" and len(key) < CHASSIS_LOOKUP_MIN_SUFFIX:
+        raise HTTPException(status_code=422, detail=f"suffix must be at least {CHASSIS_LOOKUP_MIN_SUFFIX} characters")
+    create_vehicle_chassis_index_table_if_not_exists()
+
+    params = {"limit": max(1, min(limit, 1000)), "key_type": key_type or ""}
+    table = "vehicle_chassis_index"
+    if match == "exact":
+        where = "lookup_key = {key:String}"
+        params["key"] = key
+    else:
+        # Escape LIKE wildcards so the reversed suffix is a literal prefix
+        prefix = key[::-1].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        table = "vehicle_chassis_suffix_index"
+        where = "lookup_key_rev LIKE {prefix:String}"
+        params["prefix"] = prefix + "%"
+    if key_type:
+        where += " AND key_type = {key_type:String}"
+    rows = await asyncio.to_thread(query_dicts, f"""
+        SELECT lookup_key, key_type, rc_number, source, max(updated_on) AS updated_on
+        FROM {table}
+        WHERE {where}
+        GROUP BY lookup_key, key_type, rc_number, source
+        ORDER BY updated_on DESC
+        LIMIT {{limit:UInt32}}
+    """, params)
+    return {"key": key, "match": match, "results": rows}
 
 ### Vehicle Mahindra Service History API #####
 
+# vehicleNumber -> {"watermark": (svc_date, repair_order_no), "records": {key: {amounts, ...}}}
+# A key can hold several services (same day, no repair_order_no), so each keeps a set of amounts
+service_watermarks = OrderedDict()
+
+def service_record_key(service):
+    # Matches the DEFAULTs of vehicle_service_history so keys compare with stored rows
+    return (parse_date(service.svc_date) or date(1970, 1, 1), service.repair_order_no or "")
+
+def service_record_amounts(service):
+    return (safe_float(service.net_bill_amt), safe_float(service.out_standing_amt), safe_float(service.paid_amt))
+
+def load_service_watermark(vehicle_number):
+    state = service_watermarks.get(vehicle_number)
+    if state is not None:
+        service_watermarks.move_to_end(vehicle_number)
+        return state
+    result = client.query("""
+        SELECT svc_date, repair_order_no,
+               groupUniqArray((net_bill_amt, out_standing_amt, paid_amt))
+        FROM vehicle_service_history
+        WHERE vehicleNumber = {vehicle:String}
+        GROUP BY svc_date, repair_order_no
+    """, parameters={"vehicle": vehicle_number})
+    records = {(r[0], r[1]): {tuple(amounts) for amounts in r[2]} for r in result.result_rows}
+    state = {"watermark": max(records) if records else None, "records": records}
+    service_watermarks[vehicle_number] = state
+    if len(service_watermarks) > SERVICE_WATERMARK_CACHE_MAX:
+        service_watermarks.popitem(last=False)
+    return state
+
+def services_past_watermark(state, services):
+    watermark, records = state["watermark"], state["records"]
+    selected, seen = [], set()
+    for service in services:
+        key, amounts = service_record_key(service), service_record_amounts(service)
+        if (key, amounts) in seen:
+            continue
+        if watermark is None or key > watermark or amounts not in records.get(key, ()):
+            seen.add((key, amounts))
+            selected.append(service)
+    return selected
+
+def select_new_services(vehicle_number, services):
+    """Return the services past the vehicle's watermark or with changed amounts."""
+    cached = vehicle_number in service_watermarks
+    selected = services_past_watermark(load_service_watermark(vehicle_number), services)
+    # A cached state only proves a repost is unchanged. Another worker may already have
+    # inserted what it selects, so re-read the vehicle's rows (a primary-key prefix) first.
+    if selected and cached:
+        del service_watermarks[vehicle_number]
+        selected = services_past_watermark(load_service_watermark(vehicle_number), services)
+    return selected
+
+def advance_service_watermark(vehicle_number, services):
+    state = service_watermarks.get(vehicle_number)
+    if state is None:
+        return
+    for service in services:
+        key = service_record_key(service)
+        state["records"].setdefault(key, set()).add(service_record_amounts(service))
+        if state["watermark"] is None or key > state["watermark"]:
+            state["watermark"] = key
+
 @app.post("/add_mahindra_service")
 async def add_mahindra_service(data: VehicleServiceHistory):
     create_vehicle_service_history_table_if_not_exists()
     now = datetime.now()
+    services = data.serviceHistoryDetails
+    if SERVICE_HISTORY_MODE == "incremental":
+        services = select_new_services(data.vehicleNumber, services)
     rows = []
-    for service in data.serviceHistoryDetails:
-        row = [
-            data.vehicleNumber or "",                          
-            (service.register_no or None),
-            (service.repair_order_no or None),
-            (service.repair_order_bill_no or None),
-            (service.chassis_no or None),
-            (service.location_code or None),
-            (service.location_name or None),
-            (service.dealer_code or None),
-            (service.dealer_name or None),
-            parse_date(service.svc_date),
-            parse_date(service.repair_order_bill_date),
-            (service.mileage),
-            (service.net_bill_amt),
-            (service.out_standing_amt),
-            (service.paid_amt),
-            (service.online_payment_flag or None),
-            (service.service_assistant_no or None),
-            (service.service_assistant_name or None),
-            (service.work_type or None),
-            (service.status or None),
-            (service.service_cate or None),
-            now,
-            now,
-        ]
+    for service in services:
+        row = table_row("vehicle_service_history", {
+            "vehicleNumber": data.vehicleNumber or "",
+            "register_no": service.register_no or None,
+            "repair_order_no": service.repair_order_no or "",
+            "repair_order_bill_no": service.repair_order_bill_no or None,
+            "chassis_no": service.chassis_no or None,
+            "location_code": service.location_code or None,
+            "location_name": service.location_name or None,
+            "dealer_code": service.dealer_code or None,
+            "dealer_name": service.dealer_name or None,
+            "svc_date": parse_date(service.svc_date),
+            "repair_order_bill_date": parse_date(service.repair_order_bill_date),
+            # The model carries these as strings; the columns are numeric
+            "mileage": safe_int(service.mileage),
+            "net_bill_amt": safe_float(service.net_bill_amt),
+            "out_standing_amt": safe_float(service.out_standing_amt),
+            "paid_amt": safe_float(service.paid_amt),
+            "online_payment_flag": service.online_payment_flag or None,
+            "service_assistant_no": service.service_assistant_no or None,
+            "service_assistant_name": service.service_assistant_name or None,
+            "work_type": service.work_type or None,
+            "status": service.status or None,
+            "service_cate": service.service_cate or None,
+            "created_on": now,
+            "updated_on": now,
+        })
         rows.append(row)
 
     if not rows:
-        return {"message": "No service records to insert", "vehicleNumber": data.vehicleNumber}
+        return {"message": "No service records to insert", "vehicleNumber": data.vehicleNumber,
+                "inserted": 0, "skipped": len(data.serviceHistoryDetails)}
 
     client.insert(
         "vehicle_service_history",
         rows,
-        column_names=[
-            "vehicleNumber",
-            "register_no",
-            "repair_order_no",
-            "repair_order_bill_no",
-            "chassis_no",
-            "location_code",
-            "location_name",
-            "dealer_code",
-            "dealer_name",
-            "svc_date",
-            "repair_order_bill_date",
-            "mileage",
-            "net_bill_amt",
-            "out_standing_amt",
-            "paid_amt",
-            "online_payment_flag",
-            "service_assistant_no",
-            "service_assistant_name",
-            "work_type",
-            "status",
-            "service_cate",
-            "created_on",
-            "updated_on",
-        ],
+        column_names=table_columns("vehicle_service_history"),
+    )
+
+    if SERVICE_HISTORY_MODE == "incremental":
+        advance_service_watermark(data.vehicleNumber, services)
+    record_identity("vehicle_service_history", [data.vehicleNumber])
+    index_chassis_keys(
+        [(service.chassis_no, "chassis", data.vehicleNumber) for service in services],
+        source="vehicle_service_history",
     )
 
     return {
         "message": "Mahindra service history inserted successfully",
         "vehicleNumber": data.vehicleNumber,
+        "inserted": len(rows),
+        "skipped": len(data.serviceHistoryDetails) - len(rows),
     }
 
 
 
 
 
+##### Vehicle 360 (Aggregated Profile) API #####
+
+def source_keys(source, key="source_key", number="{number:String}"):
+    """Subquery for the raw keys source stores for the vehicle, plus the number as requested."""
+    return (f"(SELECT {key} FROM vehicle_identity WHERE canonical_key = {{key:String}} AND source = '{source}'"
+            f" UNION ALL SELECT {number})")
+
+# Each query resolves its own keys through vehicle_identity (a primary-key lookup), so the
+# identity lookup runs inside every source query instead of before all of them
+VEHICLE360_SOURCES = {
+    "rc": f"SELECT * FROM vehicle_rc_v10 WHERE rc_number IN {source_keys('vehicle_rc_v10')} ORDER BY updated_on DESC LIMIT 1",
+    "fastag": f"SELECT * FROM fastag_details WHERE VRN IN {source_keys('fastag_details')}",
+    "blacklist": f"SELECT * FROM vehicle_rc_black_list WHERE regNo IN {source_keys('vehicle_rc_black_list')} ORDER BY statusAsOn DESC LIMIT 1",
+    "challans": f"SELECT * FROM vehicle_challan WHERE rcNo IN {source_keys('vehicle_challan')} OR dlRcNumber IN {source_keys('vehicle_challan')}",
+    # number is Int32; keys that are not numeric become NULL and match nothing
+    "challans_all_state": f"SELECT * FROM vehicle_challan_all_state WHERE number IN "
+                          f"{source_keys('vehicle_challan_all_state', 'toInt32OrNull(source_key)', 'toInt32OrNull({number:String})')}",
+    "service_history": f"SELECT * FROM vehicle_service_history WHERE vehicleNumber IN {source_keys('vehicle_service_history')} ORDER BY svc_date DESC",
+}
+
+vehicle360_cache = {}
+# Own pool: the default executor has only cpu_count + 4 threads, fewer than one request's sources on small hosts
+vehicle360_executor = ThreadPoolExecutor(max_workers=VEHICLE360_WORKERS, thread_name_prefix="vehicle360")
+
+async def fetch_vehicle360_source(sql, params):
+    # Server-side limit mirrors the client-side timeout so abandoned queries don't linger
+    settings = {"max_execution_time": max(1, int(VEHICLE360_TIMEOUT))}
+    rows = await asyncio.wait_for(
+        asyncio.get_running_loop().run_in_executor(vehicle360_executor, query_dicts, sql, params, settings),
+        timeout=VEHICLE360_TIMEOUT,
+    )
+    return rows
+
+@app.get("/vehicle/{number}")
+async def get_vehicle_360(number: str):
+    now = time.monotonic()
+    cache_key = canonical_vehicle_key(number) or number
+    cached = vehicle360_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return {**cached[1], "cached": True}
+
+    create_vehicle_identity_table_if_not_exists()
+    # Each source is queried with the keys it actually stores for this vehicle
+    params = {"key": canonical_vehicle_key(number), "number": number}
+    sources = {name: None for name in VEHICLE360_SOURCES}
+    errors = {}
+    results = await asyncio.gather(*(fetch_vehicle360_source(sql, params) for sql in VEHICLE360_SOURCES.values()),
+                                   return_exceptions=True)
+    for name, result in zip(VEHICLE360_SOURCES, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors[name] = "timeout"
+        elif isinstance(result, Exception):
+            logging.warning("vehicle360 source %s failed: %s", name, result)
+            errors[name] = str(result)
+        else:
+            sources[name] = result
+
+    response = {"number": number, "sources": sources, "errors": errors, "partial": bool(errors)}
+    # Only complete profiles are cached; partial ones are retried on the next request
+    if not errors and VEHICLE360_CACHE_TTL > 0:
+        if len(vehicle360_cache) >= VEHICLE360_CACHE_MAX:
+            for key in [k for k, (expires, _) in vehicle360_cache.items() if expires <= now]:
+                del vehicle360_cache[key]
+            if len(vehicle360_cache) >= VEHICLE360_CACHE_MAX:
+                vehicle360_cache.clear()
+        vehicle360_cache[cache_key] = (now + VEHICLE360_CACHE_TTL, response)
+    return {**response, "cached": False}
+
+
+##### Vehicle Identity API #####
+
+@app.get("/identity/{key}")
+async def get_identity(key: str):
+    canonical = canonical_vehicle_key(key)
+    if not canonical:
+        raise HTTPException(status_code=422, detail="key must contain letters or digits")
+    identity = await asyncio.to_thread(resolve_identity, key)
+    return {"canonical_key": canonical, "sources": identity}
+
+
+##### Bulk Export (Streaming, Keyset Paginated) API #####
+
+# Each export pages on its table's ORDER BY key. LIMIT ... WITH TIES keeps rows
+# sharing the last key on the same page, so a non-unique key never drops rows.
+EXPORTS = {
+    "challans_all_state": {
+        "table": "vehicle_challan_all_state",
+        "key": ("number", "Int32"),
+        "filter": ("state", "String"),
+        "date": "challanDate",
+    },
+    "challans": {
+        "table": "vehicle_challan",
+        "key": ("challanNo", "String"),
+        "filter": ("State", "String"),
+        "date": "dateChallan",
+    },
+    "rc": {
+        "table": "vehicle_rc_v10",
+        "key": ("rc_number", "String"),
+        "filter": ("rto_Code", "String"),
+        "date": "registration_date",
+    },
+}
+
+def build_export_query(spec, filter_value, date_from, date_to, after, limit):
+    key_column, key_type = spec["key"]
+    filter_column, filter_type = spec["filter"]
+    where = [f"{filter_column} = {{filter:{filter_type}}}"]
+    params = {"filter": filter_value, "limit": limit}
+    if date_from:
+        where.append(f"{spec['date']} >= {{date_from:Date}}")
+        params["date_from"] = date_from
+    if date_to:
+        where.append(f"{spec['date']} < addDays({{date_to:Date}}, 1)")
+        params["date_to"] = date_to
+    if after is not None:
+        where.append(f"{key_column} > {{after:{key_type}}}")
+        params["after"] = after
+    sql = f"""
+        SELECT * FROM {spec['table']}
+        WHERE {' AND '.join(where)}
+        ORDER BY {key_column}
+        LIMIT {{limit:UInt32}} WITH TIES
+    """
+    return sql, params
+
+def open_export_stream(sql, params):
+    """Run the export query and read its first block, so early errors raise before any response."""
+    stream = client.query_row_block_stream(sql, parameters=params)
+    # Exiting the context closes the stream, so stream_export's own `with` does that once it is done
+    stream.__enter__()
+    try:
+        first_block = next(stream, None)
+    except BaseException:
+        stream.__exit__(None, None, None)
+        raise
+    return stream, first_block
+
+def stream_export(spec, stream, first_block, fmt, limit):
+    """Yield NDJSON lines or CSV chunks block by block from an open ClickHouse stream."""
+    key_column = spec["key"][0]
+    count, last_key = 0, None
+    blocks = [first_block] if first_block else []
+    with stream:
+        columns = stream.source.column_names
+        key_index = columns.index(key_column)
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        for block in itertools.chain(blocks, stream):
+            if fmt == "csv":
+                writer.writerows(block)
+                chunk = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                chunk = "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in block)
+            count += len(block)
+            last_key = block[-1][key_index]
+            yield chunk
+    # A full page means there may be more; the trailer carries the cursor for the next one
+    if fmt == "ndjson":
+        next_cursor = str(last_key) if count >= limit else None
+        yield json.dumps({"next_cursor": next_cursor, "rows": count}) + "\n"
+
+async def export_response(name, filter_value, date_from, date_to, after, limit, fmt):
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=422, detail="format must be 'ndjson' or 'csv'")
+    spec = EXPORTS[name]
+    limit = max(1, min(limit or EXPORT_PAGE_SIZE, EXPORT_PAGE_SIZE_MAX))
+    # Validate everything up front: once streaming starts, errors can only surface as a truncated body
+    dates = {}
+    for field, value in (("date_from", date_from), ("date_to", date_to)):
+        dates[field] = parse_date(value)
+        if value and dates[field] is None:
+            raise HTTPException(status_code=422, detail=f"{field} is not a valid date")
+    if after is not None and spec["key"][1] == "Int32":
+        if safe_int(after) is None or not -2**31 <= safe_int(after) < 2**31:
+            raise HTTPException(status_code=422, detail=f"after must be an Int32 {spec['key'][0]}")
+        after = safe_int(after)
+    sql, params = build_export_query(spec, filter_value, dates["date_from"], dates["date_to"], after, limit)
+    # ClickHouse errors (missing table, auth, max_execution_time) surface here as a 500, not a truncated 200
+    stream, first_block = await asyncio.to_thread(open_export_stream, sql, params)
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    # The cursor is the last key value; CSV has no trailer, so clients take it from the last row
+    headers = {"X-Export-Key": spec["key"][0]}
+    return StreamingResponse(stream_export(spec, stream, first_block, fmt, limit), media_type=media_type, headers=headers)
+
+@app.get("/export/challans_all_state")
+async def export_challans_all_state(state: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                    after: Optional[str] = None, limit: Optional[int] = None, format: str = "ndjson"):
+    return await export_response("challans_all_state", state, date_from, date_to, after, limit, format)
+
+@app.get("/export/challans")
+async def export_challans(State: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          after: Optional[str] = None, limit: Optional[int] = None, format: str = "ndjson"):
+    return await export_response("challans", State, date_from, date_to, after, limit, format)
+
+@app.get("/export/rc")
+async def export_rc(rto_Code: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    after: Optional[str] = None, limit: Optional[int] = None, format: str = "ndjson"):
+    return await export_response("rc", rto_Code, date_from, date_to, after, limit, format)
+
+##### Membership (Bloom Filter) API #####
+
+# Opt-in: each worker scans the three key columns at startup, so size this before enabling
+BLOOM_FILTERS = os.getenv("BLOOM_FILTERS", "0") == "1"
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.001"))
+BLOOM_MIN_CAPACITY = int(os.getenv("BLOOM_MIN_CAPACITY", "100000"))
+# Full rebuilds only resize the filters; new keys arrive through the sync below
+BLOOM_REBUILD_INTERVAL = float(os.getenv("BLOOM_REBUILD_INTERVAL", "86400"))
+# Keys inserted by other workers reach this worker's filter within BLOOM_SYNC_INTERVAL.
+# A filter not synced for BLOOM_MAX_STALENESS is bypassed and every key goes to ClickHouse.
+BLOOM_SYNC_INTERVAL = float(os.getenv("BLOOM_SYNC_INTERVAL", "2"))
+BLOOM_SYNC_OVERLAP = int(os.getenv("BLOOM_SYNC_OVERLAP", "30"))
+BLOOM_MAX_STALENESS = float(os.getenv("BLOOM_MAX_STALENESS", str(max(10.0, 5 * BLOOM_SYNC_INTERVAL))))
+EXISTS_MAX_KEYS = int(os.getenv("EXISTS_MAX_KEYS", "10000"))
+BLOOM_PUBLISHED_CACHE_MAX = int(os.getenv("BLOOM_PUBLISHED_CACHE_MAX", "500000"))
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # Double hashing over one 128-bit digest instead of k separate hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for p in self.positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+class MembershipSet:
+    """Bloom filter over one key column, kept current through membership_recent_keys."""
+
+    def __init__(self, name, table, column):
+        self.name = name
+        self.table = table
+        self.column = column
+        self.filter = None  # None until the first build completes
+        self.building = None
+        self.built_at = None
+        self.synced_at = None  # monotonic time of the last successful build or sync
+        self.synced_until = None  # server time the next sync reads from
+        self.published = set()  # keys this worker already wrote to membership_recent_keys
+        self.lock = threading.Lock()
+
+    def record(self, key):
+        """Called by insert handlers: publish key to every worker's filter."""
+        if not BLOOM_FILTERS:
+            return
+        self.add(key)
+        # Deduplicated on an exact set, not the filter: a false positive there would
+        # keep a new key from ever reaching the other workers
+        if key in self.published:
+            return
+        create_table_if_not_exists("membership_recent_keys")
+        insert_rows("membership_recent_keys", [[self.name, key]], column_names=["set_name", "key"])
+        if len(self.published) >= BLOOM_PUBLISHED_CACHE_MAX:
+            self.published.clear()
+        self.published.add(key)
+
+    def add(self, key):
+        # Keys inserted mid-rebuild go into both filters so the swap loses nothing
+        with self.lock:
+            for bloom in (self.filter, self.building):
+                if bloom is not None:
+                    bloom.add(key)
+
+    def might_contain(self, key):
+        bloom = self.filter
+        if bloom is None or time.monotonic() - self.synced_at > BLOOM_MAX_STALENESS:
+            return True
+        return key in bloom
+
+    def server_now(self):
+        return client.query("SELECT now64(3)").result_rows[0][0]
+
+    def rebuild(self):
+        create_table_if_not_exists(self.table)
+        # Keys inserted while the scan runs are picked up by the next sync from here
+        started = self.server_now()
+        count = client.query(f"SELECT count() FROM {self.table}").result_rows[0][0]
+        with self.lock:
+            self.building = BloomFilter(int(count * 1.2) + BLOOM_MIN_CAPACITY, BLOOM_ERROR_RATE)
+        try:
+            with client.query_column_block_stream(f"SELECT {self.column} FROM {self.table}") as stream:
+                for block in stream:
+                    with self.lock:
+                        for key in block[0]:
+                            self.building.add(key)
+            with self.lock:
+                self.filter, self.building = self.building, None
+                self.synced_until = started
+                self.built_at = self.synced_at = time.monotonic()
+        except Exception:
+            with self.lock:
+                self.building = None
+            raise
+
+    def sync(self):
+        """Add keys other workers inserted since the last build or sync."""
+        now = self.server_now()
+        # Re-reading an overlap is harmless (adds are idempotent) and covers late commits
+        result = client.query("""
+            SELECT key FROM membership_recent_keys
+            WHERE set_name = {name:String}
+              AND inserted_on >= subtractSeconds({since:DateTime64(3)}, {overlap:UInt32})
+        """, parameters={"name": self.name, "since": self.synced_until, "overlap": BLOOM_SYNC_OVERLAP})
+        with self.lock:
+            for (key,) in result.result_rows:
+                self.filter.add(key)
+            self.synced_until = now
+            self.synced_at = time.monotonic()
+
+    def confirm(self, keys):
+        result = client.query(
+            f"SELECT DISTINCT {self.column} FROM {self.table} WHERE {self.column} IN {{keys:Array(String)}}",
+            parameters={"keys": keys},
+        )
+        return {row[0] for row in result.result_rows}
+
+membership_sets = {
+    "blacklist": MembershipSet("blacklist", "vehicle_rc_black_list", "regNo"),
+    "fastag": MembershipSet("fastag", "fastag_details", "VRN"),
+    "rc_chassis": MembershipSet("rc_chassis", "rc_chassis", "vehicle_num"),
+}
+
+async def membership_refresh_loop():
+    create_table_if_not_exists("membership_recent_keys")
+    while True:
+        for name, membership in membership_sets.items():
+            try:
+                if membership.filter is None or time.monotonic() - membership.built_at >= BLOOM_REBUILD_INTERVAL:
+                    start = time.perf_counter()
+                    await asyncio.to_thread(membership.rebuild)
+                    logging.info("Rebuilt %s membership filter in %.1fs", name, time.perf_counter() - start)
+                else:
+                    await asyncio.to_thread(membership.sync)
+            except Exception:
+                logging.exception("Refreshing %s membership filter failed", name)
+        await asyncio.sleep(BLOOM_SYNC_INTERVAL)
+
+@app.post("/exists")
+async def exists(data: ExistsRequest):
+    sets = data.sets or list(membership_sets)
+    unknown = [name for name in sets if name not in membership_sets]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown sets {unknown}; expected {list(membership_sets)}")
+    if len(data.keys) > EXISTS_MAX_KEYS:
+        raise HTTPException(status_code=413, detail=f"At most {EXISTS_MAX_KEYS} keys per request")
+
+    results, confirmed = {}, 0
+    for name in sets:
+        membership = membership_sets[name]
+        # A filter negative is definite up to BLOOM_SYNC_INTERVAL for keys inserted by other
+        # workers; only possible positives cost a query
+        candidates = [key for key in set(data.keys) if membership.might_contain(key)]
+        found = await asyncio.to_thread(membership.confirm, candidates) if candidates else set()
+        confirmed += len(candidates)
+        results[name] = {key: key in found for key in data.keys}
+    return {"results": results, "confirmed_in_db": confirmed}
+
+##### Profiling API #####
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+profile_lock = threading.Lock()
+
+def sample_stacks(seconds, interval):
+    """Sample every other thread's stack; return collapsed stacks for flamegraph tools."""
+    counts = Counter()
+    me = threading.get_ident()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+@app.get("/debug/profile")
+async def profile(seconds: float = 10, interval: float = 0.005):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Sampling runs in its own thread, so the worker keeps serving while it is profiled
+    if not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+        collapsed = await asyncio.to_thread(sample_stacks, seconds, max(0.001, interval))
+    finally:
+        profile_lock.release()
+    return PlainTextResponse(collapsed)
 
 
 
@@ -0,0 +1,31 @@
+"""Backfill derived tables from the rows their source tables already hold.
+
+Usage: python backfill.py TABLE [TABLE ...]
+       python backfill.py --all
+
+Derived tables are only maintained for rows ingested after they were created. Every
+backfill skips or replaces rows that are already present, so an interrupted run can
+simply be repeated.
+"""
+import argparse
+import logging
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tables", nargs="*", metavar="TABLE")
+    parser.add_argument("--all", action="store_true", help="run every backfill")
+    args = parser.parse_args()
+    tables = list(app.BACKFILLS) if args.all else args.tables
+    unknown = [table for table in tables if table not in app.BACKFILLS]
+    if not tables or unknown:
+        parser.error(f"name tables from {', '.join(app.BACKFILLS)} or pass --all")
+    logging.getLogger().setLevel(logging.INFO)
+    for table in tables:
+        app.run_backfill(table)
+
+
+if __name__ == "__main__":
+    main()
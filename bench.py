@@ -0,0 +1,133 @@
+"""Insert benchmarks against a live ClickHouse.
+
+Usage: python bench.py inserts [--rows N] [--concurrency C]
+       python bench.py startup [--budget SECONDS]
+
+Each table is benchmarked on a scratch copy (bench_<table>) so real data is untouched.
+The startup benchmark runs in fresh interpreters and exits non-zero over budget.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import app
+
+
+def sample_value(col_type):
+    if col_type.startswith("Nullable("):
+        return None
+    if col_type.startswith("Array("):
+        return []
+    if col_type.startswith("LowCardinality("):
+        return sample_value(col_type[len("LowCardinality("):-1])
+    if col_type == "Date":
+        return date.today()
+    if col_type == "DateTime":
+        return datetime.now()
+    if col_type.startswith(("UInt", "Int")):
+        return 1
+    if col_type.startswith("Float"):
+        return 1.0
+    return "BENCH0000000001"
+
+
+def sample_row(table):
+    return [sample_value(col_type) for _, col_type in app.expand_columns(table)]
+
+
+def run_inserts(table, settings, rows, concurrency):
+    """Insert rows one at a time; return (rows/s, p50 ms, p99 ms)."""
+    scratch = f"bench_{table}"
+    row = sample_row(table)
+    columns = app.table_columns(table)
+
+    def insert_one(_):
+        start = time.perf_counter()
+        app.client.insert(scratch, [row], column_names=columns, settings=settings)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(insert_one, range(rows)))
+    elapsed = time.perf_counter() - start
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return rows / elapsed, statistics.median(latencies) * 1000, p99 * 1000
+
+
+def bench_inserts(rows, concurrency):
+    for table, tuning in app.ASYNC_INSERT_TABLES.items():
+        scratch = f"bench_{table}"
+        app.client.command(f"DROP TABLE IF EXISTS {scratch}")
+        app.client.command(app.table_ddl(table).replace(f"EXISTS {table} (", f"EXISTS {scratch} (", 1))
+        modes = {
+            "sync": None,
+            "async_wait": {"async_insert": 1, "wait_for_async_insert": 1, **tuning},
+            "async_nowait": {"async_insert": 1, "wait_for_async_insert": 0, **tuning},
+        }
+        for mode, settings in modes.items():
+            throughput, p50, p99 = run_inserts(table, settings, rows, concurrency)
+            print(f"{table:28} {mode:13} {throughput:10.1f} rows/s  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+        app.client.command(f"DROP TABLE IF EXISTS {scratch}")
+
+
+def measure_import():
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(timeout=30.0):
+    """Seconds from spawning a uvicorn worker until GET / answers."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"no response within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_startup(budget):
+    import_time = measure_import()
+    first_request = measure_first_request()
+    print(f"import app           {import_time * 1000:8.1f} ms")
+    print(f"time to first request {first_request * 1000:7.1f} ms  (budget {budget * 1000:.0f} ms)")
+    return first_request <= budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=["inserts", "startup"])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET", "1.0")))
+    args = parser.parse_args()
+    if args.benchmark == "inserts":
+        bench_inserts(args.rows, args.concurrency)
+    elif args.benchmark == "startup" and not bench_startup(args.budget):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import sys
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests never reach a ClickHouse server
+os.environ.setdefault("SCHEMA_CHECK", "off")
+
+import app  # noqa: E402
+
+
+class FakeStream:
+    """A query_row_block_stream context over one block of rows."""
+
+    def __init__(self, column_names, blocks):
+        self.source = SimpleNamespace(column_names=column_names)
+        self.blocks = iter(blocks)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.blocks)
+
+
+class FakeClient:
+    """Records commands and inserts; answer(sql, parameters) supplies query result rows."""
+
+    def __init__(self, answer=None, column_names=()):
+        self.answer = answer or (lambda sql, parameters: [])
+        self.column_names = list(column_names)
+        self.commands = []
+        self.inserts = []
+
+    def command(self, sql, parameters=None, settings=None):
+        self.commands.append(sql)
+
+    def query(self, sql, parameters=None, settings=None):
+        rows = self.answer(sql, parameters or {})
+        return SimpleNamespace(result_rows=rows, named_results=lambda: (dict(zip(self.column_names, row)) for row in rows))
+
+    @contextmanager
+    def query_column_block_stream(self, sql, parameters=None):
+        rows = self.answer(sql, parameters or {})
+        yield [[[row[0] for row in rows]]] if rows else []
+
+    def query_row_block_stream(self, sql, parameters=None, settings=None):
+        rows = self.answer(sql, parameters or {})
+        return FakeStream(self.column_names, [rows] if rows else [])
+
+    def insert(self, table, rows, column_names=None, settings=None):
+        self.inserts.append(SimpleNamespace(table=table, rows=rows, column_names=column_names, settings=settings))
+
+    def rows(self, table):
+        """Rows inserted into table, as dicts keyed by column name."""
+        return [dict(zip(insert.column_names, row)) for insert in self.inserts if insert.table == table
+                for row in insert.rows]
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(app, "client", fake)
+    # Per-worker caches describe what the database holds, so a fresh fake starts them empty
+    monkeypatch.setattr(app, "ensured_tables", set())
+    monkeypatch.setattr(app, "known_identities", set())
+    monkeypatch.setattr(app, "service_watermarks", app.OrderedDict())
+    return fake
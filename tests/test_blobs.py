@@ -0,0 +1,89 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+
+
+class CountingStore(app.FilesystemBlobStore):
+    def __init__(self, root):
+        super().__init__(str(root))
+        self.puts = 0
+
+    def put(self, digest, data):
+        self.puts += 1
+        super().put(digest, data)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = CountingStore(tmp_path)
+    monkeypatch.setattr(app, "blob_store", store)
+    monkeypatch.setattr(app, "stored_blobs", app.OrderedDict())
+    return store
+
+
+def large_image(fill="A"):
+    return "data:image/jpeg;base64," + fill * (app.BLOB_INLINE_MAX + 1)
+
+
+def test_offload_blob_deduplicates(store, monkeypatch):
+    value = large_image()
+    first = app.offload_blob(value)
+    assert first.startswith(app.BLOB_REF_PREFIX)
+    assert app.offload_blob(value) == first
+    assert store.puts == 1
+
+    # A fresh worker finds the blob already stored and does not rewrite it
+    monkeypatch.setattr(app, "stored_blobs", app.OrderedDict())
+    assert app.offload_blob(value) == first
+    assert store.puts == 1
+
+    assert app.offload_blob(large_image("B")) != first
+    assert store.puts == 2
+
+
+def test_offload_blob_keeps_small_values_and_urls_inline(store):
+    url = "https://example.com/" + "x" * (app.BLOB_INLINE_MAX + 1)
+    assert app.offload_blob("short") == "short"
+    assert app.offload_blob(url) == url
+    assert app.offload_blob(None) is None
+    assert store.puts == 0
+
+
+def test_inline_limit_counts_bytes(store):
+    value = "\u20b9" * (app.BLOB_INLINE_MAX // 3 + 1)
+    assert len(value) <= app.BLOB_INLINE_MAX < len(value.encode())
+    assert app.offload_blob(value).startswith(app.BLOB_REF_PREFIX)
+
+
+def test_stored_digest_cache_is_bounded(store, monkeypatch):
+    monkeypatch.setattr(app, "BLOB_CACHE_MAX", 2)
+    digests = [app.offload_blob(large_image(fill))[len(app.BLOB_REF_PREFIX):] for fill in "ABAC"]
+    # A was used again after B, so B is the one evicted
+    assert list(app.stored_blobs) == [digests[0], digests[3]]
+    assert store.puts == 3
+
+
+def test_offload_blob_is_disabled_without_a_store(monkeypatch):
+    monkeypatch.setattr(app, "blob_store", None)
+    value = large_image()
+    assert app.offload_blob(value) == value
+
+
+def test_blob_round_trip(store):
+    value = large_image()
+    reference = app.offload_blob(value)
+
+    response = client.get(f"/blobs/{reference[len(app.BLOB_REF_PREFIX):]}")
+    assert response.status_code == 200
+    assert response.text == value
+    assert "immutable" in response.headers["cache-control"]
+
+    assert client.get(f"/blobs/{reference}").text == value
+
+
+def test_blob_fetch_errors(store):
+    assert client.get("/blobs/" + "0" * 64).status_code == 404
+    assert client.get("/blobs/not-a-digest").status_code == 422
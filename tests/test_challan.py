@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+
+
+def test_challan_violations_are_fanned_out_by_the_view(fake_client):
+    response = client.post("/add_challan_record", json={
+        "challanNo": "DL123", "rcNo": "DL01AB1234", "State": "DL", "dateChallan": "2026-01-01 10:00:00",
+        "detailsViolation": [{"offence": "Overspeeding", "penalty": "1000"}, {"offence": "No helmet"}],
+    })
+    assert response.status_code == 200
+    assert [insert.table for insert in fake_client.inserts if insert.table.startswith("vehicle_challan")] == ["vehicle_challan"]
+    [row] = fake_client.rows("vehicle_challan")
+    assert row["detailsViolation.offence"] == ["Overspeeding", "No helmet"]
+    assert row["detailsViolation.penalty"] == ["1000", ""]
+    # The view must exist before the first challan is inserted
+    assert any("MATERIALIZED VIEW IF NOT EXISTS vehicle_challan_violation_mv" in sql for sql in fake_client.commands)
+
+
+def test_violation_backfill_skips_challans_already_fanned_out(fake_client):
+    app.run_backfill("vehicle_challan_violation")
+    sql = fake_client.commands[-1]
+    assert sql.lstrip().startswith("INSERT INTO vehicle_challan_violation (offence, challanNo, penalty")
+    assert "ARRAY JOIN detailsViolation" in sql
+    assert "NOT IN (SELECT challanNo FROM vehicle_challan_violation)" in sql
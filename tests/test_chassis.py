@@ -0,0 +1,16 @@
+import app
+
+
+def test_chassis_index_keys_on_source():
+    for table in ("vehicle_chassis_index", "vehicle_chassis_suffix_index"):
+        assert app.TABLE_SPECS[table]["order_by"].endswith("rc_number, source)")
+
+
+def test_chassis_backfill_fills_both_indexes(fake_client):
+    app.run_backfill("vehicle_chassis_index")
+    exact, suffix = fake_client.commands[-2:]
+    assert exact.lstrip().startswith("INSERT INTO vehicle_chassis_index (")
+    for source in ("FROM vehicle_rc_v10", "FROM vehicle_service_history"):
+        assert source in exact
+    assert suffix.lstrip().startswith("INSERT INTO vehicle_chassis_suffix_index (")
+    assert "FROM vehicle_chassis_index" in suffix
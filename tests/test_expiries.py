@@ -0,0 +1,73 @@
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+
+
+def blacklist(**overrides):
+    fields = {"regNo": "DL01AB1234", "blacklistStatus": "NA", "statusAsOn": "2026-01-01",
+              "rcExpiryDate": "2030-01-01", "insurance_validUpto": "2026-11-01", "puccUpto": None}
+    fields.update(overrides)
+    return app.VehicleRCBlackList(**fields)
+
+
+def index_rows(fake_client):
+    """Answer the latest-expiry lookup from what was inserted, later inserts winning."""
+    def answer(sql, parameters):
+        latest = {}
+        for row in fake_client.rows("vehicle_expiry_index"):
+            if row["regNo"] == parameters["reg_no"]:
+                latest[row["expiry_type"]] = (row["expiry_date"], row["blacklistStatus"])
+        return [(expiry_type, *state) for expiry_type, state in latest.items()]
+
+    fake_client.answer = answer
+    return lambda: fake_client.rows("vehicle_expiry_index")
+
+
+def test_index_expiries_skips_unchanged_reposts(fake_client):
+    rows = index_rows(fake_client)
+    app.index_expiries(blacklist())
+    assert len(rows()) == 2
+
+    app.index_expiries(blacklist())
+    assert len(rows()) == 2
+
+    app.index_expiries(blacklist(insurance_validUpto="2027-11-01"))
+    assert [row["expiry_type"] for row in rows()[2:]] == ["insurance"]
+
+
+def test_index_expiries_sees_writes_from_other_workers(fake_client):
+    rows = index_rows(fake_client)
+    app.index_expiries(blacklist())
+    # Another worker indexes a status change for the same vehicle
+    fake_client.insert("vehicle_expiry_index", [[row["expiry_date"], row["expiry_type"], row["regNo"], "BLACKLISTED"]
+                                                for row in rows()], column_names=app.EXPIRY_INDEX_COLUMNS)
+    # The vehicle reverts on this worker; the revert must reach the index
+    app.index_expiries(blacklist())
+    assert [row["blacklistStatus"] for row in rows()] == ["NA", "NA", "BLACKLISTED", "BLACKLISTED", "NA", "NA"]
+
+
+def test_expiries_rejects_malformed_cursor(fake_client):
+    for since in ("yesterday", "2026-13-01", "2026-01-01T10:00:00+05:30"):
+        response = client.get("/expiries", params={"since": since})
+        assert response.status_code == 422
+    response = client.get("/expiries", params={"since": "2026-01-01 10:00:00.123"})
+    assert response.status_code == 200
+    assert response.json()["next_since"] == "2026-01-01 10:00:00.123"
+
+
+def test_expiry_backfill_indexes_only_vehicles_not_indexed_yet(fake_client):
+    app.run_backfill("vehicle_expiry_index")
+    sql = fake_client.commands[-1]
+    assert sql.lstrip().startswith("INSERT INTO vehicle_expiry_index (expiry_date, expiry_type, regNo, blacklistStatus)")
+    assert "WHERE regNo NOT IN (SELECT regNo FROM vehicle_expiry_index)" in sql
+
+
+def test_expiry_scan_lock_is_exclusive(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "EXPIRY_SCAN_LOCK", str(tmp_path / "scan.lock"))
+    holder = app.acquire_expiry_scan_lock()
+    assert holder is not None
+    assert app.acquire_expiry_scan_lock() is None
+    holder.close()
+    app.acquire_expiry_scan_lock().close()
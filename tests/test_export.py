@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from conftest import FakeStream
+
+client = TestClient(app.app)
+
+
+@pytest.mark.parametrize("url, detail", [
+    ("/export/challans_all_state?state=DL&after=abc", "after must be an Int32 number"),
+    ("/export/challans_all_state?state=DL&after=99999999999", "after must be an Int32 number"),
+    ("/export/rc?rto_Code=DL01&date_to=2024-13-01", "date_to is not a valid date"),
+    ("/export/challans?State=DL&date_from=garbage", "date_from is not a valid date"),
+    ("/export/rc?rto_Code=DL01&format=xml", "format must be 'ndjson' or 'csv'"),
+])
+def test_export_rejects_invalid_parameters(url, detail):
+    response = client.get(url)
+    assert response.status_code == 422
+    assert response.json() == {"detail": detail}
+
+
+def test_build_export_query_uses_keyset_cursor():
+    sql, params = app.build_export_query(app.EXPORTS["challans_all_state"], "DL", None, None, 42, 10)
+    assert "number > {after:Int32}" in sql
+    assert "OFFSET" not in sql
+    assert params == {"filter": "DL", "limit": 10, "after": 42}
+
+
+def test_export_streams_rows_and_cursor(fake_client):
+    fake_client.column_names = ["number", "challanNumber", "state"]
+    fake_client.answer = lambda sql, parameters: [(7, "C7", "DL"), (9, "C9", "DL")]
+    response = client.get("/export/challans_all_state?state=DL&limit=2")
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"number": 7, "challanNumber": "C7", "state": "DL"},
+        {"number": 9, "challanNumber": "C9", "state": "DL"},
+        {"next_cursor": "9", "rows": 2},
+    ]
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_export_query_error_is_not_a_200(fake_client, monkeypatch, fmt):
+    def failing_blocks():
+        raise RuntimeError("Code: 159. Timeout exceeded: elapsed 30 seconds")
+        yield
+
+    stream = FakeStream(["number"], failing_blocks())
+    monkeypatch.setattr(fake_client, "query_row_block_stream", lambda sql, parameters=None: stream)
+    response = TestClient(app.app, raise_server_exceptions=False).get(f"/export/challans_all_state?state=DL&format={fmt}")
+    assert response.status_code == 500
+    assert stream.closed
@@ -0,0 +1,72 @@
+import time
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def membership(fake_client):
+    table_keys, recent_keys = ["DL01AB1234"], []
+
+    def answer(sql, parameters):
+        if "now64" in sql:
+            return [(datetime(2026, 1, 1),)]
+        if "count()" in sql:
+            return [(len(table_keys),)]
+        if "membership_recent_keys" in sql:
+            return [(key,) for key in recent_keys]
+        if "keys" in parameters:
+            return [(key,) for key in parameters["keys"] if key in table_keys]
+        return [(key,) for key in table_keys]
+
+    fake_client.answer = answer
+    membership = app.MembershipSet("blacklist", "vehicle_rc_black_list", "regNo")
+    membership.rebuild()
+    return membership, recent_keys
+
+
+@pytest.fixture
+def filters_enabled(monkeypatch):
+    monkeypatch.setattr(app, "BLOOM_FILTERS", True)
+
+
+def test_filter_answers_negatives_after_build(membership):
+    membership, _ = membership
+    assert membership.might_contain("DL01AB1234")
+    assert not membership.might_contain("MH12ZZ9999")
+
+
+def test_sync_learns_keys_inserted_by_other_workers(membership):
+    membership, recent_keys = membership
+    recent_keys.append("MH12ZZ9999")
+    membership.sync()
+    assert membership.might_contain("MH12ZZ9999")
+
+
+def test_stale_filter_is_bypassed(membership, monkeypatch):
+    membership, _ = membership
+    monkeypatch.setattr(membership, "synced_at", time.monotonic() - app.BLOOM_MAX_STALENESS - 1)
+    assert membership.might_contain("MH12ZZ9999")
+
+
+def test_confirm_queries_only_candidates(membership):
+    membership, _ = membership
+    assert membership.confirm(["DL01AB1234", "KA01XX0001"]) == {"DL01AB1234"}
+
+
+def test_record_publishes_each_key_once(membership, fake_client, filters_enabled):
+    membership, _ = membership
+    membership.record("MH12ZZ9999")
+    membership.record("MH12ZZ9999")
+    assert fake_client.rows("membership_recent_keys") == [{"set_name": "blacklist", "key": "MH12ZZ9999"}]
+    assert membership.might_contain("MH12ZZ9999")
+
+
+def test_record_uses_async_insert_mode(membership, fake_client, filters_enabled, monkeypatch):
+    membership, _ = membership
+    monkeypatch.setattr(app, "INSERT_MODE", "async")
+    membership.record("MH12ZZ9999")
+    [insert] = fake_client.inserts
+    assert insert.settings["async_insert"] == 1
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def history(fake_client):
+    """vehicle_service_history as {(svc_date, repair_order_no): {amounts}}, plus a query counter."""
+    table, queries = {}, []
+
+    def answer(sql, parameters):
+        queries.append(sql)
+        return [(key[0], key[1], sorted(amounts)) for key, amounts in table.items()]
+
+    fake_client.answer = answer
+    return table, queries
+
+
+def service(svc_date, repair_order_no, net_bill_amt="1000"):
+    return app.Mahindraservice(svc_date=svc_date, repair_order_no=repair_order_no, net_bill_amt=net_bill_amt)
+
+
+def insert(table, vehicle, services):
+    """What add_mahindra_service does with the selection on this worker."""
+    for s in services:
+        table.setdefault(app.service_record_key(s), set()).add(app.service_record_amounts(s))
+    app.advance_service_watermark(vehicle, services)
+
+
+def test_unchanged_repost_is_answered_from_the_cache(history):
+    table, queries = history
+    v1 = service("2026-01-01", "R1")
+    insert(table, "DL01AB1234", [v1])
+
+    assert app.select_new_services("DL01AB1234", [v1]) == []
+    assert app.select_new_services("DL01AB1234", [v1]) == []
+    assert len(queries) == 1
+
+
+def test_new_and_changed_services_are_selected(history):
+    table, _ = history
+    v1, r2 = service("2026-01-01", "R1"), service("2026-02-01", "R2")
+    insert(table, "DL01AB1234", [v1])
+
+    assert app.select_new_services("DL01AB1234", [v1, r2, r2]) == [r2]
+    changed = service("2026-01-01", "R1", net_bill_amt="1500")
+    assert app.select_new_services("DL01AB1234", [changed]) == [changed]
+
+
+def test_service_inserted_by_another_worker_is_not_inserted_again(history, monkeypatch):
+    table, _ = history
+    v1, r2 = service("2026-01-01", "R1"), service("2026-02-01", "R2")
+    insert(table, "DL01AB1234", [v1])
+
+    worker_a, worker_b = OrderedDict(), OrderedDict()
+    for cache in (worker_a, worker_b):
+        monkeypatch.setattr(app, "service_watermarks", cache)
+        assert app.select_new_services("DL01AB1234", [v1]) == []
+
+    monkeypatch.setattr(app, "service_watermarks", worker_a)
+    selected = app.select_new_services("DL01AB1234", [v1, r2])
+    assert selected == [r2]
+    insert(table, "DL01AB1234", selected)
+
+    # Worker B's cache still ends at V1; the crawler re-sends the full history to it
+    monkeypatch.setattr(app, "service_watermarks", worker_b)
+    assert app.select_new_services("DL01AB1234", [v1, r2]) == []
@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+
+PAYLOADS = {
+    "fastag_details": ("/add_fastag", {"TagId": "T1", "VRN": "DL01AB1234", "IssueDate": "2024-01-02"},
+                       {"TagId": "T1", "VRN": "DL01AB1234", "Issue_Date": app.date(2024, 1, 2), "is_current": 1}),
+    "vehicle_rc_v10": ("/add_vehicle_rc", {"rc_number": "DL01AB1234", "registration_date": "2020-05-06"},
+                       {"rc_number": "DL01AB1234", "registration_date": app.date(2020, 5, 6), "owner_name": ""}),
+    "vehicle_challan": ("/add_challan_record", {"challanNo": "C1", "rcNo": "DL01AB1234", "dateChallan": "2026-01-01 10:00:00",
+                                                "amountChallan": 500},
+                        {"challanNo": "C1", "rcNo": "DL01AB1234", "amountChallan": 500, "forChallan": None}),
+    "vehicle_rc_black_list": ("/add_vehicle_rc_black_list", {"regNo": "DL01AB1234", "blacklistStatus": "NA",
+                                                             "statusAsOn": "2026-01-01", "puccUpto": "2026-06-01"},
+                              {"regNo": "DL01AB1234", "blacklistStatus": "NA", "statusAsOn": app.date(2026, 1, 1),
+                               "puccUpto": "2026-06-01"}),
+    "vehicle_challan_all_state": ("/add_vehicle_challan_all_state", {"number": 42, "amount": 300, "state": "DL"},
+                                  {"number": 42, "amount": 300, "state": "DL"}),
+    "rc_chassis": ("/add_rc_chassis", {"vehicle_num": "DL01AB1234"}, {"vehicle_num": "DL01AB1234"}),
+    "vehicle_service_history": ("/add_mahindra_service", {"vehicleNumber": "DL01AB1234", "serviceHistoryDetails": [
+                                    {"svc_date": "2026-01-01", "mileage": "12000", "net_bill_amt": "1500.5"}]},
+                                {"vehicleNumber": "DL01AB1234", "svc_date": app.date(2026, 1, 1), "repair_order_no": "",
+                                 "mileage": 12000, "net_bill_amt": 1500.5}),
+}
+
+
+@pytest.mark.parametrize("table", PAYLOADS)
+@pytest.mark.parametrize("reorder", [False, True])
+def test_handler_rows_follow_the_table_spec(fake_client, monkeypatch, table, reorder):
+    if reorder:
+        # Reordering a spec's columns must not move values between columns
+        monkeypatch.setitem(app.TABLE_COLUMNS, table, list(reversed(app.TABLE_COLUMNS[table])))
+    url, payload, expected = PAYLOADS[table]
+    assert client.post(url, json=payload).status_code == 200
+    [insert] = [insert for insert in fake_client.inserts if insert.table == table]
+    assert insert.column_names == app.table_columns(table)
+    [row] = fake_client.rows(table)
+    assert {column: row[column] for column in expected} == expected
+
+
+def test_table_row_rejects_rows_that_differ_from_the_spec():
+    with pytest.raises(RuntimeError, match=r"missing \['vehicle_num'\], unknown \['vehicle_number'\]"):
+        app.table_row("rc_chassis", {"vehicle_number": "DL01AB1234"})
+    with pytest.raises(RuntimeError, match="missing"):
+        app.table_row("vehicle_identity", {"canonical_key": "DL01AB1234"})
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+
+
+def test_vehicle360_resolves_identity_inside_each_source_query(fake_client, monkeypatch):
+    monkeypatch.setattr(app, "vehicle360_cache", {})
+    queries, lock = [], threading.Lock()
+
+    def answer(sql, parameters):
+        with lock:
+            queries.append((sql, parameters))
+        time.sleep(0.3)
+        return []
+
+    fake_client.answer = answer
+    start = time.perf_counter()
+    response = client.get("/vehicle/dl-01-ab-1234")
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert response.json()["errors"] == {}
+    # One round of concurrent source queries, no identity lookup ahead of them
+    assert len(queries) == len(app.VEHICLE360_SOURCES)
+    assert elapsed < 0.55
+    for sql, parameters in queries:
+        assert "FROM vehicle_identity WHERE canonical_key = {key:String}" in sql
+        assert parameters == {"key": "DL01AB1234", "number": "dl-01-ab-1234"}
+
+
+def test_record_identity_uses_async_insert_mode(fake_client, monkeypatch):
+    monkeypatch.setattr(app, "INSERT_MODE", "async")
+    app.record_identity("rc_chassis", ["dl-01-ab-1234"])
+    [insert] = fake_client.inserts
+    assert insert.table == "vehicle_identity"
+    assert insert.settings["async_insert"] == 1
+    assert fake_client.rows("vehicle_identity")[0]["source_key"] == "dl-01-ab-1234"